@@ -0,0 +1,97 @@
+# answer_warming.py
+
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+from db import get_frequent_queries
+from groq_async_client import breaker_states, get_detailed_response, get_simplified_response
+from response_cache import answer_key, answers
+from routers.ask import build_tutor_prompt
+from singleflight import llm_singleflight, prompt_key
+
+logger = logging.getLogger("answer_warming")
+
+# Off by default: every warmed answer spends Groq quota
+ANSWER_WARM_ENABLED = os.getenv("ANSWER_WARM_ENABLED", "false").lower() in ("true", "1", "yes")
+ANSWER_WARM_INTERVAL = float(os.getenv("ANSWER_WARM_INTERVAL", "21600"))
+ANSWER_WARM_INITIAL_DELAY = float(os.getenv("ANSWER_WARM_INITIAL_DELAY", "60"))
+ANSWER_WARM_TOP_N = int(os.getenv("ANSWER_WARM_TOP_N", "200"))
+ANSWER_WARM_MIN_COUNT = int(os.getenv("ANSWER_WARM_MIN_COUNT", "2"))
+ANSWER_WARM_LOOKBACK_DAYS = int(os.getenv("ANSWER_WARM_LOOKBACK_DAYS", "30"))
+# Budget per run: wall-clock seconds and concurrent questions in flight
+ANSWER_WARM_MAX_SECONDS = float(os.getenv("ANSWER_WARM_MAX_SECONDS", "600"))
+ANSWER_WARM_CONCURRENCY = int(os.getenv("ANSWER_WARM_CONCURRENCY", "2"))
+
+_task = None
+_last_run = {}
+
+async def warm_once(top_n: int = ANSWER_WARM_TOP_N, max_seconds: float = ANSWER_WARM_MAX_SECONDS) -> dict:
+    """
+    Pre-generate /ask/ answers for the most frequent past questions that aren't cached yet,
+    most frequent first, stopping when the time budget runs out or Groq's breaker opens.
+    """
+    started = time.monotonic()
+    rows = await asyncio.to_thread(
+        get_frequent_queries, top_n, ANSWER_WARM_LOOKBACK_DAYS, ANSWER_WARM_MIN_COUNT
+    )
+    stats = {"candidates": len(rows), "warmed": 0, "already_cached": 0, "skipped": 0, "failed": 0}
+    slots = asyncio.Semaphore(ANSWER_WARM_CONCURRENCY)
+    # Outlive the gap between runs so warmed entries don't expire before the next refresh
+    ttl = max(answers.ttl, 2 * ANSWER_WARM_INTERVAL)
+
+    async def warm(row):
+        key = answer_key(row["query_text"], row["sentiment_label"], row["language"])
+        if key in answers:
+            stats["already_cached"] += 1
+            return
+        async with slots:
+            if time.monotonic() - started > max_seconds or breaker_states().get("chat") != "closed":
+                stats["skipped"] += 1
+                return
+            try:
+                # Inside the try: one bad row must not abort the gather for the rest
+                prompt = build_tutor_prompt(row["query_text"], row["sentiment_label"])
+                simplified = await llm_singleflight.do(prompt_key("simplified", prompt), get_simplified_response, prompt)
+                detailed = await llm_singleflight.do(prompt_key("detailed", prompt), get_detailed_response, prompt)
+            except Exception as e:
+                logger.warning("Warming failed for %r: %s", row["query_text"], e)
+                stats["failed"] += 1
+                return
+            answers.set(key, {"simplified": simplified, "detailed": detailed}, ttl=ttl)
+            stats["warmed"] += 1
+
+    await asyncio.gather(*(warm(row) for row in rows))
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    metrics.inc("answer_warming.runs")
+    metrics.inc("answer_warming.warmed", stats["warmed"])
+    logger.info("Answer cache warming: %s", stats)
+    _last_run.clear()
+    _last_run.update(stats, finished_at=time.time())
+    return stats
+
+async def _warm_loop():
+    await asyncio.sleep(ANSWER_WARM_INITIAL_DELAY)
+    while True:
+        try:
+            await warm_once()
+        except Exception as e:
+            logger.error("Answer cache warming run failed: %s", e)
+        await asyncio.sleep(ANSWER_WARM_INTERVAL)
+
+def start_answer_warming():
+    """Schedule periodic warming if ANSWER_WARM_ENABLED; call from the event loop (app startup)"""
+    global _task
+    if ANSWER_WARM_ENABLED and (_task is None or _task.done()):
+        _task = asyncio.get_running_loop().create_task(_warm_loop())
+
+def stop_answer_warming():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+def last_run() -> dict:
+    return dict(_last_run)
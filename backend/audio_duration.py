@@ -0,0 +1,133 @@
+# audio_duration.py
+
+import struct
+
+# Bitrates in kbps by (MPEG-1?, layer); index 0 is "free format", which we can't size
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits: 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _mp3_frame(data: bytes, pos: int):
+    """(frame_bytes, samples, sample_rate, header_info_offset) for a frame header at pos, or None"""
+    if data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = 4 - ((data[pos + 1] >> 1) & 3)
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, None
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    mono = data[pos + 3] >> 6 == 3
+    # Where a Xing/Info tag would sit: after the header and the layer III side info
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, 4 + side_info
+
+def mp3_duration(data: bytes):
+    """
+    Seconds of audio in MP3 data, from the frame headers alone (no decoding). Handles
+    concatenated clips and ID3v2 tags; skips Xing/Info frames, which carry no audio.
+    None if no frames are found.
+    """
+    seconds = 0.0
+    frames = 0
+    pos = 0
+    end = len(data) - 4
+    while pos < end:
+        if data[pos:pos + 3] == b"ID3" and pos + 10 <= len(data):
+            size = (data[pos + 6] << 21) | (data[pos + 7] << 14) | (data[pos + 8] << 7) | data[pos + 9]
+            pos += 10 + size + (10 if data[pos + 5] & 0x10 else 0)
+            continue
+        frame = _mp3_frame(data, pos)
+        if frame is None:
+            pos += 1  # resync
+            continue
+        length, samples, sample_rate, info_offset = frame
+        tag = data[pos + info_offset:pos + info_offset + 4] if info_offset else b""
+        if tag not in (b"Xing", b"Info"):
+            seconds += samples / sample_rate
+            frames += 1
+        pos += max(length, 1)
+    return seconds if frames else None
+
+def ogg_opus_duration(data: bytes):
+    """
+    Seconds of Opus audio in Ogg data, from the page granule positions (always at
+    48 kHz) minus each stream's pre-skip. Chained streams (concatenated clips) are
+    summed. None if no Opus stream is found.
+    """
+    seconds = 0.0
+    found = False
+    streams = {}  # serial -> [pre-skip, last granule position]
+    pos = data.find(b"OggS")
+    while pos != -1 and pos + 27 <= len(data):
+        granule, serial = struct.unpack_from("<qI", data, pos + 6)
+        segments = data[pos + 26]
+        body = pos + 27 + segments
+        if body > len(data):
+            break
+        body_length = sum(data[pos + 27:body])
+        if data[body:body + 8] == b"OpusHead":
+            # A new stream; a chained clip may reuse the previous one's serial
+            previous = streams.pop(serial, None)
+            if previous and previous[1] is not None:
+                seconds += max(previous[1] - previous[0], 0) / 48000
+            streams[serial] = [struct.unpack_from("<H", data, body + 10)[0], None]
+            found = True
+        elif granule >= 0 and serial in streams:
+            streams[serial][1] = granule
+        pos = data.find(b"OggS", body + body_length)
+    for skip, granule in streams.values():
+        if granule is not None:
+            seconds += max(granule - skip, 0) / 48000
+    return seconds if found else None
+
+def wav_duration(data: bytes):
+    """Seconds of PCM in a WAV file, from its fmt and data chunk headers. None if not WAV."""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    byte_rate = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, pos)
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack_from("<I", data, pos + 16)[0]
+        elif chunk_id == b"data" and byte_rate:
+            # Streamed WAVs may leave the size unset; use what's actually there
+            size = min(size, len(data) - pos - 8)
+            return size / byte_rate
+        pos += 8 + size + (size & 1)
+    return None
+
+_DURATION_PARSERS = {"MP3": mp3_duration, "OGG_OPUS": ogg_opus_duration, "LINEAR16": wav_duration}
+
+def audio_duration(data: bytes, encoding: str):
+    """Seconds of audio in `data` (an AudioEncoding name), or None if it can't be read"""
+    parser = _DURATION_PARSERS.get(encoding)
+    return parser(data) if parser else None
+
+def align_timings(timings, audio: bytes, encoding: str):
+    """
+    Rescale estimated sentence timings so they span the clip's real duration. The
+    estimate's proportions (sentence lengths) are kept; only the time scale changes.
+    Returned unchanged if the duration can't be read.
+    """
+    duration = audio_duration(audio, encoding)
+    estimated = timings[-1]["end"] if timings else 0.0
+    if not duration or not estimated:
+        return timings
+    scale = duration / estimated
+    return [{**timing, "start": timing["start"] * scale, "end": timing["end"] * scale} for timing in timings]
@@ -0,0 +1,105 @@
+# audio_index.py
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from supabase_client import AUDIO_STORAGE_DIR
+
+logger = logging.getLogger("audio_index")
+
+# Lives next to the audio it points at, so the two move together
+AUDIO_INDEX_PATH = os.getenv("AUDIO_INDEX_PATH", os.path.join(AUDIO_STORAGE_DIR, "audio_index.sqlite"))
+
+class AudioIndex:
+    """
+    Persistent map from (user, query) to the voice clip generated for it, written
+    when the clip is published (or prefetched, with no URL yet), so lookups are a
+    primary-key read instead of a directory scan.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _db(self):
+        # One connection per process (uvicorn workers may fork after import)
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS voice_clips (
+                    user_id TEXT NOT NULL,
+                    query_id TEXT NOT NULL,
+                    session_id TEXT,
+                    audio_url TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    timings TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, query_id)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS voice_clips_file_path ON voice_clips (file_path)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def record(self, user_id: str, query_id: str, session_id: str, audio_url: str, file_path: str, timings):
+        """Point (user, query) at a newly published clip; the latest clip wins"""
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO voice_clips VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, query_id, session_id, audio_url, file_path, json.dumps(timings), time.time())
+            )
+            conn.commit()
+
+    def record_unpublished(self, user_id: str, query_id: str, session_id: str, file_path: str, timings):
+        """
+        Point (user, query) at a clip that is cached but not published yet (empty
+        audio_url); an existing entry for the query is kept.
+        """
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR IGNORE INTO voice_clips VALUES (?, ?, ?, '', ?, ?, ?)",
+                (user_id, query_id, session_id, file_path, json.dumps(timings), time.time())
+            )
+            conn.commit()
+
+    def lookup(self, user_id: str, query_id: str):
+        """Dict describing the clip generated for this query, or None"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT session_id, audio_url, file_path, timings, created_at FROM voice_clips "
+                "WHERE user_id = ? AND query_id = ?",
+                (user_id, query_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "session_id": row[0],
+            "audio_url": row[1],
+            "file_path": row[2],
+            "timings": json.loads(row[3]) if row[3] else [],
+            "created_at": row[4]
+        }
+
+    def forget(self, user_id: str, query_id: str):
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM voice_clips WHERE user_id = ? AND query_id = ?", (user_id, query_id))
+            conn.commit()
+
+    def forget_files(self, file_paths):
+        """Drop every entry pointing at one of these files (e.g. an evicted clip's published copies)"""
+        with self._lock:
+            conn = self._db()
+            conn.executemany("DELETE FROM voice_clips WHERE file_path = ?", [(path,) for path in file_paths])
+            conn.commit()
+
+audio_index = AudioIndex(AUDIO_INDEX_PATH)
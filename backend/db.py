@@ -185,6 +185,75 @@ def get_session_context(session_id):
         print("Returning empty context due to database error")
         return []  # Return empty context if database is unavailable
 
+def get_query_by_id(query_id, user_id=None):
+    """
+    Fetch a stored query and its answers by id (optionally scoped to a user).
+    Returns a dict or None if not found / database unavailable.
+    """
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            if user_id:
+                cur.execute("""
+                    SELECT id, session_id, query_text, groq_response_main, groq_response_simplified, user_id
+                    FROM queries WHERE id = %s AND user_id = %s;
+                """, (query_id, user_id))
+            else:
+                cur.execute("""
+                    SELECT id, session_id, query_text, groq_response_main, groq_response_simplified, user_id
+                    FROM queries WHERE id = %s;
+                """, (query_id,))
+            row = cur.fetchone()
+            if not row:
+                return None
+            return {
+                "id": str(row[0]),
+                "session_id": str(row[1]) if row[1] else None,
+                "query_text": row[2],
+                "groq_response_main": row[3],
+                "groq_response_simplified": row[4],
+                "user_id": str(row[5]) if row[5] else None
+            }
+    except Exception as e:
+        print(f"Database error in get_query_by_id: {e}")
+        return None
+
+def get_frequent_queries(limit=200, lookback_days=30, min_count=2):
+    """
+    Most frequently asked questions, grouped by normalized text (case, whitespace
+    and trailing punctuation ignored), sentiment label and response language.
+    Returns a list of dicts, most frequent first; empty if the database is unavailable.
+    """
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT rtrim(lower(regexp_replace(btrim(query_text), '\\s+', ' ', 'g')), '?.! ') AS normalized,
+                       COALESCE(sentiment_label, 'NEUTRAL') AS sentiment_label,
+                       COALESCE(response_language, 'en') AS language,
+                       MIN(query_text) AS query_text,
+                       COUNT(*) AS asked
+                FROM queries
+                WHERE query_text IS NOT NULL
+                  AND created_at >= NOW() - make_interval(days => %s)
+                GROUP BY 1, 2, 3
+                HAVING COUNT(*) >= %s
+                ORDER BY asked DESC
+                LIMIT %s;
+            """, (lookback_days, min_count, limit))
+            return [
+                {
+                    "query_text": row[3],
+                    "sentiment_label": row[1],
+                    "language": row[2],
+                    "count": row[4]
+                }
+                for row in cur.fetchall()
+            ]
+    except Exception as e:
+        print(f"Database error in get_frequent_queries: {e}")
+        return []
+
 def get_sentiment_from_text(text):
     result = classifier(text)[0]
     label = result["label"].lower()
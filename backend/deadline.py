@@ -0,0 +1,84 @@
+# deadline.py
+
+import asyncio
+import os
+import time
+
+import metrics
+
+# End-to-end latency objective for /ask/, in seconds
+ASK_DEADLINE_SECONDS = float(os.getenv("ASK_DEADLINE_SECONDS", "15"))
+
+# Cold-start cost estimates per stage (seconds), used until the stage histograms have data
+DEFAULT_STAGE_ESTIMATES = {
+    "context": 0.5,
+    "simplified": 3.0,
+    "detailed": 6.0,
+    "image": 1.0,
+}
+
+class DeadlineExceeded(Exception):
+    """A required pipeline stage could not finish before the request deadline"""
+
+class Deadline:
+    """
+    Time budget for one request, passed through the pipeline stages.
+    Stages ask whether they can afford to run and bound their awaits by what is left.
+    """
+
+    def __init__(self, budget: float, name: str = "ask"):
+        self.name = name
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.degraded = []
+
+    @classmethod
+    def from_header(cls, value: str = None, default: float = ASK_DEADLINE_SECONDS, name: str = "ask"):
+        """Use the caller's budget (seconds) if given, but never more than the service default"""
+        budget = default
+        if value:
+            try:
+                budget = min(default, max(0.0, float(value)))
+            except ValueError:
+                pass
+        return cls(budget, name)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def estimate(self, stage: str) -> float:
+        """p90 of the stage's recent latencies, or its default estimate"""
+        hist = metrics.histogram(f"{self.name}.stage.{stage}.latency")
+        return hist.percentile(90, DEFAULT_STAGE_ESTIMATES.get(stage, 1.0))
+
+    def can_afford(self, stage: str, reserve: float = 0.0) -> bool:
+        """True if the stage's estimated cost plus `reserve` for later stages still fits"""
+        return self.remaining() >= self.estimate(stage) + reserve
+
+    def timed(self, stage: str):
+        """Context manager recording the latency of a synchronous stage"""
+        return metrics.histogram(f"{self.name}.stage.{stage}.latency").time()
+
+    def degrade(self, stage: str):
+        """Record that an optional stage was skipped or cut short"""
+        self.degraded.append(stage)
+        metrics.inc(f"{self.name}.degraded.{stage}")
+
+    async def run(self, stage: str, awaitable):
+        """
+        Await a stage bounded by the remaining budget, recording its latency.
+        Raises DeadlineExceeded if the budget runs out first.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(f"No time left for stage '{stage}'")
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=remaining)
+        except asyncio.TimeoutError:
+            metrics.inc(f"{self.name}.stage.{stage}.timeouts")
+            raise DeadlineExceeded(f"Stage '{stage}' exceeded the request deadline")
+        metrics.histogram(f"{self.name}.stage.{stage}.latency").observe(time.perf_counter() - start)
+        return result
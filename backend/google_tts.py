@@ -1,54 +1,50 @@
 # google_tts.py
 
+import asyncio
 import os
+import random
+import time
 import uuid
 import json
+from google.api_core import exceptions as google_exceptions
 from google.oauth2 import service_account
 from google.cloud import texttospeech_v1 as tts
 from dotenv import load_dotenv
+
+import metrics
+from audio_duration import align_timings
+
 load_dotenv()
 GOOGLE_TTS_KEY = os.getenv("GOOGLE_TTS_KEY")  # for REST (unused here)
 PROJECT_ID = os.getenv("GOOGLE_TTS_PROJECT_ID")
 
-# Optional: use service account .json if required (recommended in prod)
-# credentials = service_account.Credentials.from_service_account_file("gcp-sa.json")
-
-client = tts.TextToSpeechClient()
+# Async client: overall budget per synthesis (seconds, retries included),
+# calls in flight per process (keep within the project's TTS quota), and retries
+GOOGLE_TTS_TIMEOUT = float(os.getenv("GOOGLE_TTS_TIMEOUT", "30"))
+GOOGLE_TTS_MAX_CONCURRENCY = int(os.getenv("GOOGLE_TTS_MAX_CONCURRENCY", "8"))
+GOOGLE_TTS_MAX_RETRIES = int(os.getenv("GOOGLE_TTS_MAX_RETRIES", "3"))
+GOOGLE_TTS_RETRY_BASE_DELAY = float(os.getenv("GOOGLE_TTS_RETRY_BASE_DELAY", "0.5"))
 
-def synthesize_with_timings(text: str, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D"):
-    input_text = tts.SynthesisInput(text=text)
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+)
 
-    voice = tts.VoiceSelectionParams(
-        language_code=language_code,
-        name=voice_name
-    )
-
-    audio_config = tts.AudioConfig(
-        audio_encoding=tts.AudioEncoding.MP3
-        # Removing enable_time_pointing as it's not supported in the current version
-    )
-
-    # Using plain text input instead of SSML with marks
-    input_text = tts.SynthesisInput(text=text)
-
-    response = client.synthesize_speech(
-        input=input_text,
-        voice=voice,
-        audio_config=audio_config
-    )
+# Optional: use service account .json if required (recommended in prod)
+# credentials = service_account.Credentials.from_service_account_file("gcp-sa.json")
 
-    # Save audio using tempfile for cross-platform compatibility
-    import tempfile
-    
-    # Create a temporary file with the correct extension
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
-        tmp_path = tmp.name
-        tmp.write(response.audio_content)
-    
-    audio_file = tmp_path
+# Clients are created on first use, so importing this module needs no credentials
+# (the local TTS backend works offline); the async one inside the event loop,
+# since gRPC aio channels are loop-bound
+_client = None
+_async_client = None
+_slots = None
 
+def estimate_timings(text: str):
     # Parse timing info - since enable_time_pointing is not available,
-    # we'll use a simple estimation method
+    # we'll use a simple estimation method (align_timings then fits it to the real audio length)
     sentences = text.split('.')
     sentences = [s.strip() for s in sentences if s.strip()]
     
@@ -75,4 +71,86 @@ def synthesize_with_timings(text: str, language_code: str = "en-US", voice_name:
             "text": sentence_with_period
         })
 
-    return audio_file, processed_timings
+    return processed_timings
+
+def synthesis_request(text: str, language_code: str, voice_name: str, encoding: str = "MP3", sample_rate_hertz: int = None):
+    voice = tts.VoiceSelectionParams(
+        language_code=language_code,
+        name=voice_name
+    )
+
+    # encoding is an AudioEncoding name (MP3, OGG_OPUS, LINEAR16); None keeps the voice's natural rate
+    audio_config = tts.AudioConfig(
+        audio_encoding=tts.AudioEncoding[encoding],
+        sample_rate_hertz=sample_rate_hertz or 0
+        # Removing enable_time_pointing as it's not supported in the current version
+    )
+
+    # Using plain text input instead of SSML with marks
+    input_text = tts.SynthesisInput(text=text)
+
+    return tts.SynthesizeSpeechRequest(input=input_text, voice=voice, audio_config=audio_config)
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = tts.TextToSpeechClient()
+    return _client
+
+def synthesize_audio(text: str, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D"):
+    """MP3 bytes straight from the TTS response, and sentence timings fitted to the audio's duration"""
+    response = get_client().synthesize_speech(request=synthesis_request(text, language_code, voice_name))
+    return response.audio_content, align_timings(estimate_timings(text), response.audio_content, "MP3")
+
+def get_async_client():
+    global _async_client, _slots
+    if _async_client is None:
+        _async_client = tts.TextToSpeechAsyncClient()
+        _slots = asyncio.Semaphore(GOOGLE_TTS_MAX_CONCURRENCY)
+    return _async_client
+
+async def close_async_client():
+    global _async_client, _slots
+    if _async_client is not None:
+        await _async_client.transport.close()
+        _async_client = None
+        _slots = None
+
+async def synthesize_audio_async(text: str, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D", encoding: str = "MP3", sample_rate_hertz: int = None, timeout: float = GOOGLE_TTS_TIMEOUT):
+    """
+    Non-blocking synthesize_audio, in any output encoding. At most GOOGLE_TTS_MAX_CONCURRENCY calls are in
+    flight per process; transient errors are retried with jittered backoff while
+    the `timeout` budget (covering all attempts) lasts.
+    """
+    async_client = get_async_client()
+    request = synthesis_request(text, language_code, voice_name, encoding, sample_rate_hertz)
+    expires_at = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        remaining = expires_at - time.monotonic()
+        try:
+            async with _slots:
+                response = await async_client.synthesize_speech(request=request, timeout=max(remaining, 0.1))
+            return response.audio_content, align_timings(estimate_timings(text), response.audio_content, encoding)
+        except TRANSIENT_ERRORS as e:
+            delay = random.uniform(0, GOOGLE_TTS_RETRY_BASE_DELAY * (2 ** attempt))
+            attempt += 1
+            if attempt > GOOGLE_TTS_MAX_RETRIES or time.monotonic() + delay >= expires_at:
+                metrics.inc("google_tts.failures")
+                raise
+            metrics.inc("google_tts.retries")
+            await asyncio.sleep(delay)
+
+def synthesize_with_timings(text: str, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D"):
+    """File-based variant of synthesize_audio: returns (temp file path, timings)"""
+    audio_content, timings = synthesize_audio(text, language_code, voice_name)
+
+    # Save audio using tempfile for cross-platform compatibility
+    import tempfile
+    
+    # Create a temporary file with the correct extension
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
+        tmp_path = tmp.name
+        tmp.write(audio_content)
+
+    return tmp_path, timings
@@ -0,0 +1,284 @@
+# groq_async_client.py
+
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger("groq_async_client")
+
+# ---- Configuration ----
+# GROQ_BASE_URL can point at groq_stub_server.py for local load tests
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1").rstrip("/")
+# groq_client.py isn't in this tree, so the model and answer-style prompts below are our
+# own defaults rather than a port; set them to match the deployment's sync client
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+GROQ_WHISPER_MODEL = os.getenv("GROQ_WHISPER_MODEL", "whisper-large-v3")
+
+# System prompts per answer style; an empty value sends the user prompt alone
+GROQ_SIMPLIFIED_SYSTEM_PROMPT = os.getenv(
+    "GROQ_SIMPLIFIED_SYSTEM_PROMPT",
+    "Answer in 2-3 short, simple sentences a beginner can follow. No headings or lists."
+)
+GROQ_DETAILED_SYSTEM_PROMPT = os.getenv(
+    "GROQ_DETAILED_SYSTEM_PROMPT",
+    "Give a thorough, well-structured explanation with key concepts, steps and an example."
+)
+GROQ_VOICE_SYSTEM_PROMPT = os.getenv(
+    "GROQ_VOICE_SYSTEM_PROMPT",
+    "Write a detailed explanation meant to be read aloud: plain sentences, no markdown, tables or code blocks."
+)
+GROQ_SIMPLIFIED_MAX_TOKENS = int(os.getenv("GROQ_SIMPLIFIED_MAX_TOKENS", "256"))
+GROQ_DETAILED_MAX_TOKENS = int(os.getenv("GROQ_DETAILED_MAX_TOKENS", "1024"))
+
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "30"))
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "10"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+GROQ_RETRY_BASE_DELAY = float(os.getenv("GROQ_RETRY_BASE_DELAY", "0.5"))
+GROQ_RETRY_MAX_DELAY = float(os.getenv("GROQ_RETRY_MAX_DELAY", "8"))
+
+# Quotas (requests per minute) from the Groq plan; bursts are capped by the bucket size
+GROQ_CHAT_RPM = float(os.getenv("GROQ_CHAT_RPM", "30"))
+GROQ_WHISPER_RPM = float(os.getenv("GROQ_WHISPER_RPM", "20"))
+GROQ_BURST = int(os.getenv("GROQ_BURST", "5"))
+
+# Circuit breaker: open after N consecutive upstream failures, probe again after the cooldown
+GROQ_BREAKER_THRESHOLD = int(os.getenv("GROQ_BREAKER_THRESHOLD", "5"))
+GROQ_BREAKER_COOLDOWN = float(os.getenv("GROQ_BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class GroqError(Exception):
+    """Groq call failed (non-retryable status or retries exhausted)"""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class GroqUnavailableError(GroqError):
+    """Raised without calling upstream while the circuit breaker is open"""
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                metrics.inc("groq.rate_limited_waits")
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed -> open after `threshold` failures; open -> half-open after `cooldown`
+    seconds, letting a single probe through; the probe's outcome closes or reopens it.
+    """
+
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            metrics.inc(f"groq.{self.name}.breaker_rejected")
+            raise GroqUnavailableError(f"Groq {self.name} circuit is open; failing fast")
+        if state == "half-open":
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        # A probe that ended without a verdict (e.g. cancelled) says nothing about upstream health; let the next call probe
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Groq {self.name} circuit opened after {self.failures} failures")
+                metrics.inc(f"groq.{self.name}.breaker_opened")
+            self.opened_at = time.monotonic()
+
+_client = None
+_buckets = {
+    "chat": TokenBucket(GROQ_CHAT_RPM / 60.0, GROQ_BURST),
+    "whisper": TokenBucket(GROQ_WHISPER_RPM / 60.0, GROQ_BURST),
+}
+_breakers = {
+    "chat": CircuitBreaker("chat", GROQ_BREAKER_THRESHOLD, GROQ_BREAKER_COOLDOWN),
+    "whisper": CircuitBreaker("whisper", GROQ_BREAKER_THRESHOLD, GROQ_BREAKER_COOLDOWN),
+}
+
+def get_client() -> httpx.AsyncClient:
+    """Shared keep-alive connection pool, created on first use inside the event loop"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=GROQ_BASE_URL,
+            headers={"Authorization": f"Bearer {GROQ_API_KEY}"},
+            timeout=httpx.Timeout(GROQ_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+                keepalive_expiry=60.0
+            )
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def breaker_states() -> dict:
+    return {name: breaker.state for name, breaker in _breakers.items()}
+
+def _retry_delay(attempt: int, response: httpx.Response = None) -> float:
+    # Honour Retry-After on 429s, otherwise exponential backoff with full jitter
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), GROQ_RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+    return random.uniform(0, min(GROQ_RETRY_MAX_DELAY, GROQ_RETRY_BASE_DELAY * (2 ** attempt)))
+
+async def _request(kind: str, op: str, path: str, **kwargs) -> dict:
+    breaker = _breakers[kind]
+    breaker.before_call()
+    # Whole call, retries and backoff included (what the caller waits); plus each attempt
+    latency = metrics.histogram(f"groq.{op}.latency")
+    attempt_latency = metrics.histogram(f"groq.{op}.attempt_latency")
+    call_start = time.perf_counter()
+
+    try:
+        last_error = None
+        for attempt in range(GROQ_MAX_RETRIES + 1):
+            await _buckets[kind].acquire()
+            response = None
+            start = time.perf_counter()
+            try:
+                response = await get_client().post(path, **kwargs)
+            except httpx.HTTPError as e:
+                # Transport errors, and also e.g. a body that fails to decode
+                last_error = GroqError(f"Groq {op} request error: {e}")
+            else:
+                attempt_latency.observe(time.perf_counter() - start)
+                if response.status_code == 200:
+                    try:
+                        data = response.json()
+                    except ValueError as e:
+                        last_error = GroqError(f"Groq {op} returned invalid JSON: {e}")
+                    else:
+                        breaker.record_success()
+                        latency.observe(time.perf_counter() - call_start)
+                        return data
+                elif response.status_code not in RETRYABLE_STATUS:
+                    # Upstream is reachable and a 4xx is our fault; don't trip the breaker
+                    breaker.record_success()
+                    latency.observe(time.perf_counter() - call_start)
+                    raise GroqError(f"Groq {op} failed: {response.status_code} {response.text[:200]}", response.status_code)
+                else:
+                    last_error = GroqError(f"Groq {op} returned {response.status_code}", response.status_code)
+
+            if attempt < GROQ_MAX_RETRIES:
+                metrics.inc(f"groq.{op}.retries")
+                delay = _retry_delay(attempt, response)
+                logger.warning(f"{last_error}; retrying in {delay:.2f}s (attempt {attempt + 1}/{GROQ_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+    finally:
+        # However the call ends (cancelled, unexpected error), a half-open probe must not
+        # stay claimed; success and failure below already clear it, so this is a no-op then
+        breaker.release_probe()
+
+    breaker.record_failure()
+    latency.observe(time.perf_counter() - call_start)
+    metrics.inc(f"groq.{op}.failures")
+    raise last_error
+
+async def chat_completion(messages: list, max_tokens: int = 1024, temperature: float = 0.5, op: str = "chat") -> str:
+    data = await _request("chat", op, "/chat/completions", json={
+        "model": GROQ_MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    })
+    return data["choices"][0]["message"]["content"].strip()
+
+# ---- Tutor helpers (async counterparts of the groq_client helpers) ----
+
+def _messages(system_prompt: str, prompt: str) -> list:
+    messages = [{"role": "user", "content": prompt}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    return messages
+
+async def get_groq_response(prompt: str) -> str:
+    return await chat_completion(_messages(None, prompt), op="groq")
+
+async def get_simplified_response(prompt: str) -> str:
+    return await chat_completion(_messages(GROQ_SIMPLIFIED_SYSTEM_PROMPT, prompt), max_tokens=GROQ_SIMPLIFIED_MAX_TOKENS, op="simplified")
+
+async def get_detailed_response(prompt: str) -> str:
+    return await chat_completion(_messages(GROQ_DETAILED_SYSTEM_PROMPT, prompt), max_tokens=GROQ_DETAILED_MAX_TOKENS, op="detailed")
+
+async def get_voice_explanation_response(prompt: str) -> str:
+    return await chat_completion(_messages(GROQ_VOICE_SYSTEM_PROMPT, prompt), max_tokens=GROQ_DETAILED_MAX_TOKENS, op="voice")
+
+async def transcribe_with_whisper(file_path: str) -> str:
+    audio_bytes = await asyncio.to_thread(_read_file, file_path)
+    data = await _request(
+        "whisper", "whisper", "/audio/transcriptions",
+        data={"model": GROQ_WHISPER_MODEL, "response_format": "json"},
+        files={"file": (os.path.basename(file_path), audio_bytes)}
+    )
+    return data.get("text", "")
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Local Groq stub server for tests and load tests.
+Implements the two OpenAI-compatible endpoints used by groq_async_client.py.
+
+    uvicorn groq_stub_server:app --port 8002
+    GROQ_BASE_URL=http://localhost:8002 python main.py
+
+Behaviour is tuned with environment variables:
+    STUB_LATENCY      base latency in seconds (default 0.2)
+    STUB_JITTER       extra random latency in seconds (default 0.1)
+    STUB_429_RATE     fraction of requests answered with 429 (default 0)
+    STUB_5XX_RATE     fraction of requests answered with 503 (default 0)
+"""
+
+import asyncio
+import os
+import random
+import time
+
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse
+
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0.2"))
+STUB_JITTER = float(os.getenv("STUB_JITTER", "0.1"))
+STUB_429_RATE = float(os.getenv("STUB_429_RATE", "0"))
+STUB_5XX_RATE = float(os.getenv("STUB_5XX_RATE", "0"))
+
+app = FastAPI()
+stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+async def _simulate():
+    """Sleep like a real upstream and maybe return an injected failure"""
+    stats["requests"] += 1
+    await asyncio.sleep(STUB_LATENCY + random.uniform(0, STUB_JITTER))
+    roll = random.random()
+    if roll < STUB_429_RATE:
+        stats["rate_limited"] += 1
+        return JSONResponse({"error": {"message": "Rate limit reached"}}, status_code=429, headers={"retry-after": "1"})
+    if roll < STUB_429_RATE + STUB_5XX_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "Service unavailable"}}, status_code=503)
+    return None
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    failure = await _simulate()
+    if failure:
+        return failure
+    last_message = body.get("messages", [{}])[-1].get("content", "")
+    return {
+        "id": f"stub-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": f"[stub answer] {last_message[-200:]}"},
+            "finish_reason": "stop"
+        }]
+    }
+
+@app.post("/audio/transcriptions")
+async def audio_transcriptions(file: UploadFile = File(...), model: str = Form(None)):
+    audio = await file.read()
+    failure = await _simulate()
+    if failure:
+        return failure
+    return {"text": f"stub transcript of {len(audio)} bytes"}
+
+@app.get("/")
+def read_root():
+    return {"status": "Groq stub running", **stats}
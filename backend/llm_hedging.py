@@ -0,0 +1,76 @@
+# llm_hedging.py
+
+import asyncio
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger("llm_hedging")
+
+# Hedge after Groq has been slower than this percentile of its recent latencies
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("true", "1", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3.0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+PRIMARY_BACKEND = "groq"
+HEDGE_BACKEND = "tinyllama"
+
+def hedge_delay(op: str) -> float:
+    """Seconds to wait on Groq before firing the hedge, from the op's latency histogram"""
+    hist = metrics.histogram(f"groq.{op}.latency")
+    if hist.snapshot()["count"] < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(LLM_HEDGE_MIN_DELAY, hist.percentile(LLM_HEDGE_PERCENTILE, LLM_HEDGE_DEFAULT_DELAY))
+
+async def _cancel(task: asyncio.Task):
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+
+async def hedged_generate(op: str, primary_fn, prompt: str, hedge_fn=None):
+    """
+    Run `primary_fn(prompt)` (Groq) and, if it hasn't answered within the hedge
+    delay or fails outright, race it against `hedge_fn()` (local TinyLlama).
+    Whichever produces an answer first wins and the other is cancelled.
+
+    `hedge_fn` returns the answer or None when the local model is unavailable.
+    Returns (answer, backend) where backend is "groq" or "tinyllama".
+    """
+    if not LLM_HEDGE_ENABLED or hedge_fn is None:
+        return await primary_fn(prompt), PRIMARY_BACKEND
+
+    primary = asyncio.ensure_future(primary_fn(prompt))
+    hedge = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay(op))
+        if primary in done and primary.exception() is None:
+            return primary.result(), PRIMARY_BACKEND
+
+        metrics.inc(f"hedge.{op}.fired")
+        if primary in done:
+            logger.warning(f"Groq {op} failed ({primary.exception()}); trying {HEDGE_BACKEND}")
+        else:
+            logger.info(f"Groq {op} slower than hedge deadline; racing {HEDGE_BACKEND}")
+        hedge = asyncio.ensure_future(hedge_fn())
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if hedge in done and hedge.exception() is None and hedge.result():
+                metrics.inc(f"hedge.{op}.won_by_{HEDGE_BACKEND}")
+                return hedge.result(), HEDGE_BACKEND
+            if primary in done and primary.exception() is None:
+                metrics.inc(f"hedge.{op}.won_by_{PRIMARY_BACKEND}")
+                return primary.result(), PRIMARY_BACKEND
+
+        # Neither produced an answer; surface Groq's error to the caller's fallback path
+        return primary.result(), PRIMARY_BACKEND
+    finally:
+        await _cancel(primary)
+        await _cancel(hedge)
@@ -7,6 +7,12 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import os
 import tempfile
+import metrics
+from answer_warming import last_run as answer_warming_last_run, start_answer_warming, stop_answer_warming
+from groq_async_client import close_client as close_groq_client, breaker_states
+from tinyllama_client import close_client as close_tinyllama_client, health_state as tinyllama_health, start_health_prober
+from tts_backends import close_backends as close_tts_backends
+from voice_prefetch import queue_state as voice_prefetch_state, start_voice_prefetch, stop_voice_prefetch
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -41,7 +47,7 @@ app.add_middleware(
     ],
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD"],
-    allow_headers=["Content-Type", "Authorization", "Accept", "X-Requested-With"],
+    allow_headers=["Content-Type", "Authorization", "Accept", "X-Requested-With", "X-Request-Deadline"],
     expose_headers=["Content-Length", "Date", "X-Request-ID"],
     max_age=600  # Cache preflight requests for 10 minutes
 )
@@ -50,6 +56,25 @@ app.add_middleware(
 async def root():
     return {"message": "AffectLearn API is running!", "status": "healthy"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process counters and latency histograms (LLM coalescing, etc.)"""
+    return {**metrics.snapshot(), "groq_breakers": breaker_states(), "tinyllama": tinyllama_health(), "answer_warming": answer_warming_last_run(), "voice_prefetch": voice_prefetch_state()}
+
+@app.on_event("startup")
+async def start_probers():
+    start_health_prober()
+    start_answer_warming()
+    start_voice_prefetch()
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    stop_answer_warming()
+    stop_voice_prefetch()
+    await close_groq_client()
+    await close_tinyllama_client()
+    await close_tts_backends()
+
 app.include_router(ask.router)
 app.include_router(audio_sentiment.router)  # This now includes text_to_sentiment
 app.include_router(generate_voice.router)
@@ -0,0 +1,107 @@
+# metrics.py
+
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Simple in-process metrics registry.
+# Counters and latency histograms are kept per worker process and exposed via GET /metrics.
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+# Upper bounds in seconds; the last bucket catches everything slower
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+def inc(name: str, value: int = 1):
+    """Increment a named counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def get_counter(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram that also keeps a window of recent samples
+    so callers can ask for a percentile (e.g. to derive hedging deadlines).
+    """
+
+    def __init__(self, name: str, buckets=DEFAULT_LATENCY_BUCKETS, window: int = 512):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+            self._recent.append(value)
+
+    def time(self):
+        """Context manager that observes the elapsed wall time of its block"""
+        return _Timer(self)
+
+    def percentile(self, q: float, default: float = None):
+        """Percentile (0-100) over the recent sample window, or `default` when empty"""
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return default
+        index = min(len(samples) - 1, max(0, int(round(q / 100.0 * (len(samples) - 1)))))
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            buckets = {}
+            cumulative = 0
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                buckets[f"le_{bound}"] = cumulative
+            buckets["le_inf"] = self._count
+            count, total = self._count, self._sum
+        return {
+            "count": count,
+            "sum": round(total, 4),
+            "avg": round(total / count, 4) if count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "buckets": buckets
+        }
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+def histogram(name: str, buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+    """Get or create a named histogram"""
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram(name, buckets)
+        return hist
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        histograms = list(_histograms.values())
+    return {
+        "counters": counters,
+        "histograms": {h.name: h.snapshot() for h in histograms}
+    }
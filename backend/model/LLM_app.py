@@ -1,19 +1,124 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
+import asyncio
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
 import torch
 
+from generation_scheduler import GenerationScheduler
+from prefix_cache import PrefixCache
+from prompts import build_structured_prompt, get_user_prompt_prefix
+from quantization import load_int8_model, quantize_int8
+from result_cache import ResultCache, model_revision
+from sse import sse_event
+from stopping import SENTINEL, StopSequenceMatcher, sentinel_token_variants
+
 app = FastAPI()
 
+logger = logging.getLogger("tinyllama")
+
 BASE_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
 ADAPTER_PATH = "lora-tinyllama-stem-10k"
+# Directory written by build_merged_model.py; when set, the adapter is already merged in
+MERGED_MODEL_PATH = os.getenv("TINYLLAMA_MODEL_PATH")
+MAX_BATCH_SIZE = int(os.getenv("TINYLLAMA_MAX_BATCH_SIZE", "8"))
+PREFIX_CACHE_SIZE = int(os.getenv("TINYLLAMA_PREFIX_CACHE_SIZE", "16"))
+RESULT_CACHE_SIZE = int(os.getenv("TINYLLAMA_RESULT_CACHE_SIZE", "1024"))
+# SQLite file to keep generated answers across restarts (unset = memory only)
+RESULT_CACHE_PATH = os.getenv("TINYLLAMA_RESULT_CACHE_PATH")
+REPETITION_PENALTY = 1.1
+# /explain/batch: max items per call, and how many of them may be decoding at once.
+# Always fewer than MAX_BATCH_SIZE, so a running batch leaves rows for interactive requests
+BATCH_MAX_ITEMS = int(os.getenv("TINYLLAMA_BATCH_MAX_ITEMS", "5000"))
+BATCH_CONCURRENCY = min(
+    int(os.getenv("TINYLLAMA_BATCH_CONCURRENCY", str(max(1, MAX_BATCH_SIZE // 2)))),
+    max(1, MAX_BATCH_SIZE - 1)
+)
+
+# Decode budget per answer type; generation normally ends earlier at "End of answer."
+ANSWER_TOKEN_BUDGETS = {
+    "text": 256,
+    "stepwise": 320,
+    "code": 400,
+    "table": 400,
+}
+
+def load_model():
+    """Base model + LoRA adapter, or the prebuilt merged artifact if TINYLLAMA_MODEL_PATH is set"""
+    if not MERGED_MODEL_PATH:
+        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
+        model = AutoModelForCausalLM.from_pretrained(BASE_MODEL, device_map="auto")
+        return tokenizer, PeftModel.from_pretrained(model, ADAPTER_PATH), {"base_model": BASE_MODEL, "adapter": ADAPTER_PATH, "quantization": None}
+
+    manifest = {}
+    manifest_path = os.path.join(MERGED_MODEL_PATH, "merge_manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    quantization = os.getenv("TINYLLAMA_QUANTIZE", manifest.get("quantization") or "none")
+    manifest["quantization"] = None if quantization == "none" else quantization
 
-tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-model = AutoModelForCausalLM.from_pretrained(BASE_MODEL, device_map="auto")
-model = PeftModel.from_pretrained(model, ADAPTER_PATH)
+    tokenizer = AutoTokenizer.from_pretrained(MERGED_MODEL_PATH)
+    quantized_weights = manifest.get("quantized_weights")
+    if quantization == "int8" and quantized_weights and os.path.exists(os.path.join(MERGED_MODEL_PATH, quantized_weights)):
+        # The weights the build script quantized and checked for parity, loaded without fp32 copies
+        model = load_int8_model(MERGED_MODEL_PATH, os.path.join(MERGED_MODEL_PATH, quantized_weights))
+    elif quantization == "int8":
+        # No saved int8 weights (TINYLLAMA_QUANTIZE on an fp32 build): quantize now.
+        # Dynamic int8 kernels are CPU-only
+        model = quantize_int8(AutoModelForCausalLM.from_pretrained(MERGED_MODEL_PATH, torch_dtype=torch.float32, low_cpu_mem_usage=True))
+    else:
+        model = AutoModelForCausalLM.from_pretrained(MERGED_MODEL_PATH, device_map="auto")
+    manifest["path"] = MERGED_MODEL_PATH
+    return tokenizer, model, manifest
+
+tokenizer, model, model_info = load_model()
 model.eval()
 
+# Token-level matcher for the "End of answer." sentinel every template asks for
+sentinel_matcher = StopSequenceMatcher(sentinel_token_variants(tokenizer))
+
+# KV state of the fixed instruction preambles, reused across requests
+prefix_cache = PrefixCache(model, maxsize=PREFIX_CACHE_SIZE)
+
+# Finished answers; decoding is greedy, so identical prompts give identical output
+result_cache = ResultCache(model_revision(model_info), maxsize=RESULT_CACHE_SIZE, path=RESULT_CACHE_PATH)
+
+# Continuous-batching scheduler shared by all /explain requests
+scheduler = GenerationScheduler(
+    model,
+    tokenizer,
+    max_batch_size=MAX_BATCH_SIZE,
+    repetition_penalty=REPETITION_PENALTY,
+    eos_token_id=tokenizer.eos_token_id,
+    prefix_cache=prefix_cache
+)
+
+# (level, affiliation) pairs the frontend sends; their preambles are precomputed at startup
+COMMON_PROMPT_PROFILES = [
+    ("college", "student"),
+    ("college", "teacher"),
+    ("school", "student"),
+    ("class 10", "student"),
+    ("class 12", "student"),
+]
+
+# Short generation run after startup so the first real request doesn't pay for lazy init
+WARMUP_QUERY = "What is an atom?"
+WARMUP_TOKENS = 8
+# Failed warmups are retried with exponential backoff, capped at the max delay
+WARMUP_RETRY_DELAY = float(os.getenv("TINYLLAMA_WARMUP_RETRY_DELAY", "1"))
+WARMUP_RETRY_MAX_DELAY = float(os.getenv("TINYLLAMA_WARMUP_RETRY_MAX_DELAY", "60"))
+warmup_done = threading.Event()
+warmup_task = None
+
 # ---- Request/Response Schema ----
 class QueryRequest(BaseModel):
     query: str
@@ -21,114 +126,219 @@ class QueryRequest(BaseModel):
     affiliation: str = "student"  # Optional: role/field/stream
     mode: str = "default"       # "table", "stepwise", etc.
 
-def get_user_prompt_prefix(level, affiliation):
-    if level.lower() in ["class 10", "class 12", "school"]:
-        intro = "You are an approachable tutor. Answer in very simple, beginner-friendly language for a high school student."
-    elif level.lower() == "college":
-        intro = "You are a helpful tutor. Give a clear, detailed answer suitable for a college student."
-    else:
-        intro = f"You are a helpful tutor. Adapt your answer for a {level} student."
+class BatchItem(QueryRequest):
+    id: Optional[str] = None    # echoed back so a caller can resume a partial run
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
 
-    if "teacher" in affiliation.lower():
-        intro += " Your answer can include additional depth and optional teaching tips."
-    elif "student" in affiliation.lower():
-        intro += " Use simple analogies and avoid jargon if possible."
+@lru_cache(maxsize=64)
+def preamble_ids(level, affiliation):
+    """
+    Token ids of the part of every template that precedes the question.
+    The answer-type instructions come after the question, so this is the
+    longest span whose KV state doesn't depend on what was asked.
+    """
+    preamble = get_user_prompt_prefix(level, affiliation) + "\nQuestion:"
+    return tuple(tokenizer(preamble)["input_ids"])
 
-    special_patch = (
-        " If the question is about Java, do NOT mention destructors—Java does not have destructors like C++/Python. "
-        "Focus on OOP concepts relevant to Java: class, object, inheritance, encapsulation, polymorphism, abstraction, interface."
+def cached_prefix_length(prompt_ids, level, affiliation):
+    """Length of the reusable preamble, or 0 if it tokenizes differently inside this prompt"""
+    prefix = preamble_ids(level, affiliation)
+    if len(prefix) < len(prompt_ids) and tuple(prompt_ids[:len(prefix)]) == prefix:
+        return len(prefix)
+    return 0
+
+def token_budget(answer_type, mode="default"):
+    if answer_type == "text" and mode == "stepwise":
+        return ANSWER_TOKEN_BUDGETS["stepwise"]
+    return ANSWER_TOKEN_BUDGETS.get(answer_type, ANSWER_TOKEN_BUDGETS["text"])
+
+def result_key(formatted, max_new_tokens):
+    return result_cache.key(
+        formatted,
+        max_new_tokens=max_new_tokens,
+        repetition_penalty=REPETITION_PENALTY,
+        stop=SENTINEL,
+        decoding="greedy"
     )
-    return intro + special_patch
-
-def detect_answer_type(query, mode):
-    # Table: compare/difference queries
-    table_keywords = ["difference", "differences", "compare", "comparison", "versus", "vs.", "table"]
-    # Code: code/algorithm/program queries
-    code_keywords = [
-        "python code", "code in", "program", "write a program", "algorithm", "source code",
-        "write code", "function to", "script", "snippet", "java code", "c++ code", "javascript code"
-    ]
-
-    q = query.lower()
-    if mode == "table" or any(w in q for w in table_keywords):
-        return "table"
-    if any(w in q for w in code_keywords):
-        return "code"
-    return "text"
-
-def llm_structured_response(query, level="college", mode="default", affiliation="student", max_new_tokens=400):
-    # Detect answer type
-    answer_type = detect_answer_type(query, mode)
-    student_line = get_user_prompt_prefix(level, affiliation) + "\n"
-
-    if answer_type == "table":
-        prompt = (
-            f"{student_line}"
-            f"Question: {query}\n"
-            "First, give a concise 2-3 sentence summary.\n"
-            "Then, provide a Markdown table comparing the most important features, differences, or pros/cons. "
-            "The table must be clear, at least 4 rows, and with good headings.\n"
-            "Below the table, add 2-3 key bullet points highlighting main insights or practical implications.\n"
-            "End with a study tip and 'End of answer.'\n"
-            "\n"
-            "Example table format:\n"
-            "| Feature           | IPv4                   | IPv6                      |\n"
-            "|-------------------|------------------------|---------------------------|\n"
-            "| Address Length    | 32 bits                | 128 bits                  |\n"
-            "| Address Format    | Dotted decimal         | Hexadecimal               |\n"
-            "| Address Space     | ~4.3 billion           | ~3.4 x 10^38              |\n"
-            "| Security          | Optional (IPSec)       | Built-in (IPSec required) |\n"
-            "\n"
-            "- IPv6 offers a vastly larger address space and improved security.\n"
-            "- Transitioning from IPv4 to IPv6 is a global effort.\n"
-            "- IPv6 uses a different address notation, which is more complex but future-proof.\n"
-            "Tip: Review this table for quick revision before exams.\n"
-            "End of answer."
-        )
-    elif answer_type == "code":
-        prompt = (
-            f"{student_line}"
-            f"Question: {query}\n"
-            "Provide a step-by-step explanation first (2-3 sentences max if needed). Then output only a clean code block (in correct language, use triple backticks markdown, e.g. ```python ...```). "
-            "If there's input/output, show a sample. Do not output extra explanation after the code. Always end the code block with 'End of answer.' on a new line."
-        )
-    elif mode == "stepwise":
-        prompt = (
-            f"{student_line}"
-            f"Question: {query}\n"
-            "Format your answer as:\n"
-            "Title: ...\n"
-            "Summary: ...\n"
-            "Steps:\n1. ...\n2. ...\n3. ...\n"
-            "End with a key takeaway and 'End of answer.'"
-        )
-    else:
-        prompt = (
-            f"{student_line}"
-            f"Question: {query}\n"
-            "Give a concise summary, key points or steps, and end with 'End of answer.'"
-        )
-    formatted = f"{prompt}\n\n### Answer:"
-    inputs = tokenizer(formatted, return_tensors="pt").to(model.device)
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            do_sample=False,
-            temperature=0.0,
-            repetition_penalty=1.1,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.eos_token_id
-        )
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+
+def extract_answer(response):
     answer = response.split("### Answer:")[-1].strip() if "### Answer:" in response else response.strip()
     if "End of answer." in answer:
         answer = answer.split("End of answer.")[0].strip() + "\nEnd of answer."
+    return answer
+
+async def batched_structured_response(query, level="college", mode="default", affiliation="student", max_new_tokens=None):
+    """Full answer for one query, decoded by the shared batching scheduler (or from the result cache)"""
+    formatted, answer_type = build_structured_prompt(query, level, mode, affiliation)
+    max_new_tokens = max_new_tokens or token_budget(answer_type, mode)
+    key = result_key(formatted, max_new_tokens)
+    # SQLite-backed: keep the lookup off the event loop
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached is not None:
+        return cached
+    prompt_ids = tokenizer(formatted)["input_ids"]
+    handle = scheduler.submit(
+        prompt_ids,
+        max_new_tokens,
+        sentinel_matcher.fresh(),
+        cached_prefix_length(prompt_ids, level, affiliation)
+    )
+    try:
+        generated = await handle.result()
+    except asyncio.CancelledError:
+        handle.cancel()
+        raise
+    response = tokenizer.decode(prompt_ids + generated, skip_special_tokens=True)
+    answer = extract_answer(response)
+    await asyncio.to_thread(result_cache.set, key, answer, answer_type)
     return answer, answer_type
 
+class TokenStreamDecoder:
+    """
+    Incremental detokenizer: decodes a sliding window of ids so SentencePiece
+    spacing comes out right, and holds back text that ends mid UTF-8 character.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def push(self, token_id):
+        self.ids.append(token_id)
+        prefix_text = self.tokenizer.decode(self.ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(self.ids[self.prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.ids)
+            return new_text[len(prefix_text):]
+        return ""
+
+async def stream_structured_response(query, level="college", mode="default", affiliation="student", max_new_tokens=None):
+    """
+    Server-sent events for one answer: a `meta` event with the answer type, one
+    unnamed event per decoded text chunk, then a `done` event with the final
+    post-processed answer (same as /explain would return). A cached answer is
+    sent as a single chunk.
+    """
+    formatted, answer_type = build_structured_prompt(query, level, mode, affiliation)
+    max_new_tokens = max_new_tokens or token_budget(answer_type, mode)
+    key = result_key(formatted, max_new_tokens)
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached is not None:
+        answer, answer_type = cached
+        yield sse_event({"answer_type": answer_type}, event="meta")
+        yield sse_event({"token": answer})
+        yield sse_event({"answer": answer, "answer_type": answer_type, "finish_reason": "cached"}, event="done")
+        return
+    prompt_ids = tokenizer(formatted)["input_ids"]
+    handle = scheduler.submit(
+        prompt_ids,
+        max_new_tokens,
+        sentinel_matcher.fresh(),
+        cached_prefix_length(prompt_ids, level, affiliation)
+    )
+    decoder = TokenStreamDecoder(tokenizer)
+    try:
+        yield sse_event({"answer_type": answer_type}, event="meta")
+        async for token_id in handle.stream():
+            text = decoder.push(token_id)
+            if text:
+                yield sse_event({"token": text})
+        response = tokenizer.decode(prompt_ids + handle.generated, skip_special_tokens=True)
+        answer = extract_answer(response)
+        await asyncio.to_thread(result_cache.set, key, answer, answer_type)
+        yield sse_event({
+            "answer": answer,
+            "answer_type": answer_type,
+            "finish_reason": handle.finish_reason
+        }, event="done")
+    except Exception as e:
+        yield sse_event({"error": str(e)}, event="error")
+    finally:
+        # Client went away (or we finished): free the batch slot
+        handle.cancel()
+
+async def warmup():
+    """Run one short generation, retrying until it succeeds; /ready stays 503 until then"""
+    formatted, _ = build_structured_prompt(WARMUP_QUERY)
+    prompt_ids = tokenizer(formatted)["input_ids"]
+    prefix_len = cached_prefix_length(prompt_ids, "college", "student")
+    delay = WARMUP_RETRY_DELAY
+    attempt = 1
+    while True:
+        try:
+            await scheduler.submit(prompt_ids, WARMUP_TOKENS, None, prefix_len).result()
+            break
+        except Exception as e:
+            logger.warning("TinyLlama warmup attempt %d failed: %s; retrying in %.1fs", attempt, e, delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_DELAY)
+        attempt += 1
+    logger.info("TinyLlama warmup finished after %d attempt(s)", attempt)
+    warmup_done.set()
+
+def batch_order(items):
+    """
+    Indices grouped by answer type and then by prompt length, so rows that
+    share the batch have similar budgets and finish around the same step.
+    """
+    keyed = []
+    for index, item in enumerate(items):
+        formatted, answer_type = build_structured_prompt(item.query, item.level, item.mode, item.affiliation)
+        keyed.append((answer_type, token_budget(answer_type, item.mode), len(formatted), index))
+    return [index for *_, index in sorted(keyed)]
+
+async def stream_batch(items):
+    """
+    NDJSON lines, one per item in completion order. BATCH_CONCURRENCY workers
+    take items in batch_order, so at most that many are with the scheduler at a
+    time and interactive requests still get slots.
+    """
+    order = iter(batch_order(items))
+    finished = asyncio.Queue()
+
+    async def worker():
+        # Workers share one iterator; next() never awaits, so each index is taken once
+        for index in order:
+            item = items[index]
+            line = {"id": item.id, "index": index, "query": item.query}
+            try:
+                line["answer"], line["answer_type"] = await batched_structured_response(
+                    item.query, item.level, item.mode, item.affiliation
+                )
+            except Exception as e:
+                line["error"] = str(e)
+            await finished.put(line)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BATCH_CONCURRENCY, len(items)))]
+    try:
+        for _ in items:
+            yield json.dumps(await finished.get()) + "\n"
+    finally:
+        for task in workers:
+            task.cancel()
+
+@app.on_event("startup")
+async def start_scheduler():
+    for level, affiliation in COMMON_PROMPT_PROFILES:
+        prefix_cache.get(preamble_ids(level, affiliation))
+    global warmup_task
+    scheduler.start()
+    warmup_task = asyncio.create_task(warmup())
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    if warmup_task is not None:
+        warmup_task.cancel()
+    scheduler.stop()
+
 @app.post("/explain")
 async def explain(req: QueryRequest):
-    answer, answer_type = llm_structured_response(
+    answer, answer_type = await batched_structured_response(
         req.query,
         req.level,
         req.mode,
@@ -143,6 +353,33 @@ async def explain(req: QueryRequest):
         "answer_type": answer_type  # "table", "code", or "text"
     }
 
+@app.post("/explain/stream")
+async def explain_stream(req: QueryRequest):
+    return StreamingResponse(
+        stream_structured_response(req.query, req.level, req.mode, req.affiliation),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/explain/batch")
+async def explain_batch(req: BatchRequest):
+    if len(req.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} requests per batch")
+    return StreamingResponse(stream_batch(req.requests), media_type="application/x-ndjson")
+
+@app.get("/health")
+def health():
+    """Liveness: the process is up and serving HTTP"""
+    return {"status": "ok", "pid": os.getpid()}
+
+@app.get("/ready")
+def ready():
+    """Readiness: the scheduler is running and a warmup generation has completed"""
+    stats = scheduler.stats()
+    if not (warmup_done.is_set() and stats.get("running")):
+        return JSONResponse(status_code=503, content={"status": "warming up", "pid": os.getpid()})
+    return {"status": "ready", "pid": os.getpid()}
+
 @app.get("/")
 def read_root():
-    return {"status": "LLM API running"}
+    return {"status": "LLM API running", "model": model_info, "scheduler": scheduler.stats(), "result_cache": result_cache.stats()}
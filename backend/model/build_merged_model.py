@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Build a merged TinyLlama artifact for CPU inference.
+
+Folds the lora-tinyllama-stem-10k adapter into the base weights so the server
+no longer wraps the model in PeftModel or runs adapter layers on every forward
+pass, and saves the result with its tokenizer. With --quantize int8 the Linear
+layers are also dynamically quantized and that state_dict is saved next to the
+fp32 weights; LLM_app.py loads it as-is, so the server runs exactly the int8
+weights that passed the parity check.
+
+--check-parity compares greedy output of the merged (and int8) model against
+the unmerged adapter on prompts built by the server's own templates, and
+refuses to save when agreement is below the thresholds.
+
+    python build_merged_model.py --output tinyllama-stem-merged --quantize int8 --check-parity
+    python ../start_tinyllama.py --model-path model/tinyllama-stem-merged
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from prompts import build_structured_prompt
+from quantization import quantize_int8
+
+BASE_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
+ADAPTER_PATH = "lora-tinyllama-stem-10k"
+MANIFEST_NAME = "merge_manifest.json"
+INT8_WEIGHTS_NAME = "int8_state_dict.pt"
+
+# (query, level, mode, affiliation): one prompt per answer template and preamble style
+PARITY_PROMPTS = [
+    ("What is Newton's second law of motion?", "college", "default", "student"),
+    ("Explain the difference between mitosis and meiosis.", "school", "default", "student"),
+    ("Write a Python program to check if a number is prime.", "college", "default", "teacher"),
+    ("How does photosynthesis work?", "class 10", "stepwise", "student"),
+]
+
+def greedy_outputs(model, tokenizer, max_new_tokens, prompts=PARITY_PROMPTS):
+    outputs = []
+    for query, level, mode, affiliation in prompts:
+        prompt, _ = build_structured_prompt(query, level, mode, affiliation)
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.no_grad():
+            generated = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                repetition_penalty=1.1,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tokenizer.eos_token_id
+            )
+        outputs.append(generated[0, inputs["input_ids"].shape[-1]:].tolist())
+    return outputs
+
+def agreement(reference, candidate):
+    """Fraction of reference tokens reproduced before the first divergence, per prompt"""
+    scores = []
+    for ref, cand in zip(reference, candidate):
+        same = 0
+        for a, b in zip(ref, cand):
+            if a != b:
+                break
+            same += 1
+        scores.append(same / max(1, len(ref)))
+    return scores
+
+def merged_parity_ok(scores):
+    """The merge must reproduce the adapter's greedy output exactly"""
+    return min(scores) >= 1.0
+
+def int8_parity_ok(scores, min_agreement):
+    """
+    Greedy decoding drifts once one logit flips, so int8 can't be held to the merged
+    model's exact match; the mean prefix agreement must clear the bar
+    """
+    return sum(scores) / len(scores) >= min_agreement
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the STEM LoRA adapter into TinyLlama")
+    parser.add_argument("--base", default=BASE_MODEL)
+    parser.add_argument("--adapter", default=ADAPTER_PATH)
+    parser.add_argument("--output", default="tinyllama-stem-merged")
+    parser.add_argument("--quantize", choices=["none", "int8"], default="none")
+    parser.add_argument("--check-parity", action="store_true", help="compare greedy output against the unmerged model")
+    parser.add_argument("--parity-tokens", type=int, default=48)
+    parser.add_argument("--min-int8-agreement", type=float, default=0.75,
+                        help="lowest mean int8 agreement (fraction of reference tokens matched before the first divergence) to save")
+    args = parser.parse_args()
+
+    print(f"📦 Loading base model {args.base} and adapter {args.adapter}")
+    tokenizer = AutoTokenizer.from_pretrained(args.base)
+    model = AutoModelForCausalLM.from_pretrained(args.base, torch_dtype=torch.float32)
+    model = PeftModel.from_pretrained(model, args.adapter)
+    model.eval()
+
+    reference = None
+    if args.check_parity:
+        print("🔎 Generating reference outputs with the unmerged adapter...")
+        reference = greedy_outputs(model, tokenizer, args.parity_tokens)
+
+    print("🔧 Merging adapter weights into the base model...")
+    model = model.merge_and_unload()
+    model.eval()
+
+    if args.check_parity:
+        merged_scores = agreement(reference, greedy_outputs(model, tokenizer, args.parity_tokens))
+        print(f"   merged vs unmerged agreement: {[round(s, 3) for s in merged_scores]}")
+        if not merged_parity_ok(merged_scores):
+            print("✗ Merged model diverges from the adapter model; not saving")
+            sys.exit(1)
+        print("✓ Merged output matches the unmerged adapter")
+
+    quantized = None
+    if args.quantize == "int8":
+        start = time.perf_counter()
+        quantized = quantize_int8(model)
+        print(f"   int8 quantization took {time.perf_counter() - start:.1f}s")
+        if args.check_parity:
+            quant_scores = agreement(reference, greedy_outputs(quantized, tokenizer, args.parity_tokens))
+            mean_score = sum(quant_scores) / len(quant_scores)
+            print(f"   int8 vs unmerged agreement: {[round(s, 3) for s in quant_scores]} (mean {mean_score:.3f})")
+            if not int8_parity_ok(quant_scores, args.min_int8_agreement):
+                print(f"✗ int8 agreement {mean_score:.3f} is below {args.min_int8_agreement}; not saving")
+                sys.exit(1)
+            print("✓ int8 output is within the agreement threshold")
+
+    os.makedirs(args.output, exist_ok=True)
+    model.save_pretrained(args.output, safe_serialization=True)
+    tokenizer.save_pretrained(args.output)
+    if quantized is not None:
+        torch.save(quantized.state_dict(), os.path.join(args.output, INT8_WEIGHTS_NAME))
+
+    manifest = {
+        "base_model": args.base,
+        "adapter": os.path.abspath(args.adapter),
+        "quantization": None if args.quantize == "none" else args.quantize,
+        "quantized_weights": INT8_WEIGHTS_NAME if quantized is not None else None,
+        "built_at": int(time.time())
+    }
+    with open(os.path.join(args.output, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"✓ Saved merged model to {args.output}")
+    print(f"  Start the server with: python start_tinyllama.py --model-path {os.path.abspath(args.output)}")
+
+if __name__ == "__main__":
+    main()
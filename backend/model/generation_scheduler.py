@@ -0,0 +1,379 @@
+# generation_scheduler.py
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger("generation_scheduler")
+
+class GenerationHandle:
+    """
+    One queued generation. Created on the event loop by GenerationScheduler.submit();
+    the scheduler thread pushes tokens into it and settles it when the sequence finishes.
+    """
+
+    def __init__(self, prompt_ids, max_new_tokens, loop, stop_matcher=None, prefix_len=0):
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.stop_matcher = stop_matcher
+        # Leading prompt tokens that form a reusable preamble (always leaves >= 1 token to prefill)
+        self.prefix_len = max(0, min(prefix_len, len(self.prompt_ids) - 1))
+        self.generated = []
+        self.finish_reason = None
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self._loop = loop
+        self._done = loop.create_future()
+        self._tokens = asyncio.Queue()
+        self._seen = set(self.prompt_ids)
+        self._seen_tensor = None
+
+    def cancel(self):
+        """Ask the scheduler to drop this sequence at the next decode step"""
+        self.cancelled = True
+
+    async def result(self) -> list:
+        """Generated token ids (prompt excluded) once the sequence finishes"""
+        return await self._done
+
+    async def stream(self):
+        """Yield generated token ids as they are decoded"""
+        while True:
+            token_id = await self._tokens.get()
+            if token_id is None:
+                break
+            yield token_id
+        await self._done  # surface scheduler errors to the consumer
+
+    # ---- Called from the scheduler thread ----
+
+    def _emit(self, token_id: int):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.generated.append(token_id)
+        if token_id not in self._seen:
+            self._seen.add(token_id)
+            self._seen_tensor = None
+        self._loop.call_soon_threadsafe(self._tokens.put_nowait, token_id)
+
+    def _seen_ids(self, device) -> torch.Tensor:
+        if self._seen_tensor is None:
+            self._seen_tensor = torch.tensor(sorted(self._seen), dtype=torch.long, device=device)
+        return self._seen_tensor
+
+    def _finish(self, reason: str, error: Exception = None):
+        self.finish_reason = reason
+
+        def settle():
+            self._tokens.put_nowait(None)
+            if self._done.done():
+                return
+            if error is not None:
+                self._done.set_exception(error)
+            else:
+                self._done.set_result(self.generated)
+
+        self._loop.call_soon_threadsafe(settle)
+
+class GenerationScheduler:
+    """
+    Continuous-batching greedy decoder.
+
+    Requests wait in a queue; a single worker thread keeps one running batch with a
+    left-padded KV cache. Between decode steps it prefills newly queued prompts and
+    merges them into the batch, and drops sequences as soon as they hit EOS or their
+    token budget, so the batch size follows the number of concurrent requests.
+    Decoding matches model.generate(do_sample=False, repetition_penalty=...).
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, repetition_penalty: float = 1.1, eos_token_id: int = None, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.max_batch_size = max_batch_size
+        self.repetition_penalty = repetition_penalty
+        self.eos_token_id = eos_token_id if eos_token_id is not None else tokenizer.eos_token_id
+        self.pad_token_id = self.eos_token_id
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+
+        # Running batch state (scheduler thread only); row i belongs to self._active[i]
+        self._active = []
+        self._past = None   # legacy tuple of (key, value) per layer, [B, heads, T, head_dim]
+        self._mask = None   # [B, T] attention mask, 0 for left padding
+        self._last = None   # [B] last emitted token per row
+
+        self._stats = {"submitted": 0, "completed": 0, "errors": 0, "steps": 0, "batched_rows": 0, "tokens": 0}
+
+    @property
+    def device(self):
+        return self.model.device
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Generation scheduler started (max batch size {self.max_batch_size})")
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        # Anything still queued (or submitted while stopping) would otherwise wait forever
+        self._fail_queued(RuntimeError("Generation scheduler stopped"))
+
+    def submit(self, prompt_ids, max_new_tokens: int, stop_matcher=None, prefix_len: int = 0) -> GenerationHandle:
+        """
+        Queue a prompt (token ids) for generation; call from the event loop.
+        `stop_matcher` (see stopping.py) ends the sequence as soon as it reports a match.
+        `prefix_len` marks a leading preamble whose KV state can come from the prefix cache.
+        """
+        handle = GenerationHandle(prompt_ids, max_new_tokens, asyncio.get_running_loop(), stop_matcher, prefix_len)
+        self._stats["submitted"] += 1
+        if self._stop.is_set():
+            handle._finish("error", RuntimeError("Generation scheduler stopped"))
+            self._stats["errors"] += 1
+            return handle
+        self._queue.put(handle)
+        return handle
+
+    def stats(self) -> dict:
+        steps = self._stats["steps"]
+        return {
+            **self._stats,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queued": self._queue.qsize(),
+            "active": len(self._active),
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self._stats["batched_rows"] / steps, 2) if steps else 0.0,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None
+        }
+
+    # ---- Scheduler thread ----
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._admit(block=not self._active)
+                if self._active:
+                    self._step()
+            except Exception as e:
+                logger.exception(f"Generation step failed: {e}")
+                self._fail_all(e)
+        stopped = RuntimeError("Generation scheduler stopped")
+        self._fail_all(stopped)
+        self._fail_queued(stopped)
+
+    def _admit(self, block: bool):
+        """Pull queued requests into the batch (blocking only when idle)"""
+        new = []
+        while len(self._active) + len(new) < self.max_batch_size:
+            try:
+                handle = self._queue.get(block=block and not new)
+            except queue.Empty:
+                break
+            if handle is None:
+                break
+            if handle.cancelled:
+                handle._finish("cancelled")
+                continue
+            new.append(handle)
+        if new:
+            try:
+                self._prefill(new)
+            except Exception as e:
+                # These left the queue but never joined the batch, so _fail_all won't see them
+                for handle in new:
+                    if handle not in self._active:
+                        handle._finish("error", e)
+                        self._stats["errors"] += 1
+                raise
+
+    def _prefill(self, handles):
+        plain = []
+        for handle in handles:
+            if self.prefix_cache is not None and handle.prefix_len:
+                self._prefill_from_prefix(handle)
+            else:
+                plain.append(handle)
+        if plain:
+            self._prefill_batch(plain)
+
+    @torch.no_grad()
+    def _prefill_batch(self, handles):
+        length = max(len(h.prompt_ids) for h in handles)
+        input_ids = torch.full((len(handles), length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(handles), length), dtype=torch.long)
+        for row, handle in enumerate(handles):
+            input_ids[row, length - len(handle.prompt_ids):] = torch.tensor(handle.prompt_ids, dtype=torch.long)
+            mask[row, length - len(handle.prompt_ids):] = 1
+        input_ids = input_ids.to(self.device)
+        mask = mask.to(self.device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        outputs = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids, use_cache=True)
+        self._join(handles, outputs, mask)
+
+    @torch.no_grad()
+    def _prefill_from_prefix(self, handle):
+        """Resume from the cached preamble state and prefill only the rest of the prompt"""
+        prefix_past = self.prefix_cache.get(handle.prompt_ids[:handle.prefix_len])
+        suffix = handle.prompt_ids[handle.prefix_len:]
+        input_ids = torch.tensor([suffix], dtype=torch.long, device=self.device)
+        mask = torch.ones((1, len(handle.prompt_ids)), dtype=torch.long, device=self.device)
+        position_ids = torch.arange(handle.prefix_len, len(handle.prompt_ids), device=self.device).unsqueeze(0)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=prefix_past,
+            use_cache=True
+        )
+        self._join([handle], outputs, mask)
+
+    def _join(self, handles, outputs, mask):
+        """Pick each new row's first token and merge the rows into the running batch"""
+        next_tokens = self._select(outputs.logits[:, -1, :], handles)
+        first_row = len(self._active)
+        self._merge(handles, outputs.past_key_values, mask)
+        self._last[first_row:] = next_tokens
+        self._accept(range(first_row, len(self._active)), next_tokens.tolist())
+
+    @torch.no_grad()
+    def _step(self):
+        self._drop([row for row, h in enumerate(self._active) if h.cancelled], reason="cancelled")
+        if not self._active:
+            return
+
+        position_ids = self._mask.sum(-1, keepdim=True)
+        mask = torch.cat([self._mask, torch.ones((self._mask.shape[0], 1), dtype=self._mask.dtype, device=self.device)], dim=-1)
+        outputs = self.model(
+            input_ids=self._last.unsqueeze(-1),
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=self._past,
+            use_cache=True
+        )
+        self._past = outputs.past_key_values
+        self._mask = mask
+        self._last = self._select(outputs.logits[:, -1, :], self._active)
+
+        self._stats["steps"] += 1
+        self._stats["batched_rows"] += len(self._active)
+        self._accept(range(len(self._active)), self._last.tolist())
+
+    def _select(self, logits: torch.Tensor, handles) -> torch.Tensor:
+        """Greedy token choice with HF-style repetition penalty over prompt + generated ids"""
+        logits = logits.float()
+        if self.repetition_penalty != 1.0:
+            for row, handle in enumerate(handles):
+                ids = handle._seen_ids(logits.device)
+                score = logits[row].gather(0, ids)
+                score = torch.where(score < 0, score * self.repetition_penalty, score / self.repetition_penalty)
+                logits[row].scatter_(0, ids, score)
+        return logits.argmax(dim=-1)
+
+    def _accept(self, rows, tokens):
+        finished = []
+        for row, token_id in zip(rows, tokens):
+            handle = self._active[row]
+            handle._emit(token_id)
+            self._stats["tokens"] += 1
+            reason = self._stop_reason(handle, token_id)
+            if reason:
+                finished.append((row, reason))
+        if finished:
+            done = [(self._active[row], reason) for row, reason in finished]
+            self._drop([row for row, _ in finished])
+            for handle, reason in done:
+                self._stats["completed"] += 1
+                handle._finish(reason)
+
+    def _stop_reason(self, handle: GenerationHandle, token_id: int):
+        if token_id == self.eos_token_id:
+            return "eos"
+        if handle.stop_matcher is not None and handle.stop_matcher.feed(token_id):
+            return "stop_sequence"
+        if len(handle.generated) >= handle.max_new_tokens:
+            return "length"
+        return None
+
+    # ---- Batch bookkeeping ----
+
+    def _merge(self, handles, past, mask):
+        """Append freshly prefilled rows to the running batch, left-padding the shorter cache"""
+        if self._past is None:
+            self._past, self._mask = past, mask
+            self._last = torch.zeros(len(handles), dtype=torch.long, device=self.device)
+        else:
+            length = max(self._mask.shape[1], mask.shape[1])
+            old_past, old_mask = _pad_cache(self._past, self._mask, length)
+            new_past, new_mask = _pad_cache(past, mask, length)
+            self._past = tuple(
+                (torch.cat([ok, nk], dim=0), torch.cat([ov, nv], dim=0))
+                for (ok, ov), (nk, nv) in zip(old_past, new_past)
+            )
+            self._mask = torch.cat([old_mask, new_mask], dim=0)
+            self._last = torch.cat([self._last, torch.zeros(len(handles), dtype=torch.long, device=self.device)])
+        self._active.extend(handles)
+
+    def _drop(self, rows, reason: str = None):
+        """Remove rows from the batch and trim padding columns no remaining row needs"""
+        if not rows:
+            return
+        drop = set(rows)
+        if reason:
+            for row in drop:
+                self._active[row]._finish(reason)
+        keep = [row for row in range(len(self._active)) if row not in drop]
+        self._active = [self._active[row] for row in keep]
+        if not keep:
+            self._past = self._mask = self._last = None
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        mask = self._mask.index_select(0, index)
+        start = int(mask.any(dim=0).long().argmax())
+        self._mask = mask[:, start:]
+        self._past = tuple(
+            (k.index_select(0, index)[:, :, start:, :], v.index_select(0, index)[:, :, start:, :])
+            for k, v in self._past
+        )
+        self._last = self._last.index_select(0, index)
+
+    def _fail_all(self, error: Exception):
+        for handle in self._active:
+            handle._finish("error", error)
+            self._stats["errors"] += 1
+        self._active = []
+        self._past = self._mask = self._last = None
+
+    def _fail_queued(self, error: Exception):
+        while True:
+            try:
+                handle = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if handle is not None:
+                handle._finish("error", error)
+                self._stats["errors"] += 1
+
+def _pad_cache(past, mask, length: int):
+    pad = length - mask.shape[1]
+    if pad == 0:
+        return past, mask
+    padded = tuple((F.pad(k, (0, 0, pad, 0)), F.pad(v, (0, 0, pad, 0))) for k, v in past)
+    return padded, F.pad(mask, (pad, 0))
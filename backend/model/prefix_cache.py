@@ -0,0 +1,57 @@
+# prefix_cache.py
+
+import threading
+from collections import OrderedDict
+
+import torch
+
+class PrefixCache:
+    """
+    LRU cache of key/value states for fixed prompt preambles, keyed by their token ids.
+    A request whose prompt starts with a cached preamble only needs to prefill the rest.
+    Cached tensors are never modified: the model concatenates new positions into fresh tensors.
+    """
+
+    def __init__(self, model, maxsize: int = 16):
+        self.model = model
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix_ids):
+        """Cached past_key_values for these ids (batch size 1), computing them on a miss"""
+        key = tuple(prefix_ids)
+        with self._lock:
+            past = self._entries.get(key)
+            if past is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return past
+            self.misses += 1
+
+        past = self._compute(key)
+        with self._lock:
+            self._entries[key] = past
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return past
+
+    @torch.no_grad()
+    def _compute(self, key):
+        input_ids = torch.tensor([key], dtype=torch.long, device=self.model.device)
+        outputs = self.model(input_ids=input_ids, use_cache=True)
+        return outputs.past_key_values
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
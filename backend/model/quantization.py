@@ -0,0 +1,35 @@
+# quantization.py
+#
+# Dynamic int8 quantization of the Linear layers: build_merged_model.py saves the
+# quantized state, LLM_app.py loads it
+
+import torch
+from accelerate import init_empty_weights
+from torch.ao.nn.quantized.dynamic import Linear as DynamicInt8Linear
+from transformers import AutoConfig, AutoModelForCausalLM
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of all Linear layers (CPU only); `model` is left as is"""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_int8_model(model_path, weights_path):
+    """
+    The model saved by quantize_int8 + torch.save(state_dict), without ever holding
+    fp32 Linear weights: the skeleton is built on the meta device, its Linear layers
+    are swapped for empty int8 ones and the saved tensors are assigned in place.
+    Peak memory is about the size of the int8 checkpoint.
+    """
+    config = AutoConfig.from_pretrained(model_path)
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, torch.nn.Linear):
+                setattr(module, name, DynamicInt8Linear(
+                    child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8
+                ))
+    model.load_state_dict(torch.load(weights_path, map_location="cpu"), assign=True)
+    missing = [name for name, tensor in [*model.named_parameters(), *model.named_buffers()] if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"int8 checkpoint {weights_path} doesn't cover: {', '.join(missing[:5])}")
+    return model
@@ -0,0 +1,130 @@
+# result_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def model_revision(info: dict) -> str:
+    """
+    Short fingerprint of the loaded weights: the model description plus the
+    names, sizes and mtimes of the files in the adapter / merged model directory.
+    """
+    files = []
+    path = info.get("path") or info.get("adapter")
+    if path and os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            stat = os.stat(os.path.join(path, name))
+            files.append((name, stat.st_size, int(stat.st_mtime)))
+    blob = json.dumps({"info": info, "files": files}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+class ResultCache:
+    """
+    LRU cache of finished answers for greedy generation, where the output is a
+    pure function of the formatted prompt, the weights and the generation
+    parameters. Optionally backed by a SQLite file so entries survive restarts
+    and are shared by every worker on the host.
+    """
+
+    def __init__(self, revision: str, maxsize: int = 1024, path: str = None, disk_maxsize: int = 100000):
+        self.revision = revision
+        self.maxsize = maxsize
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self._writes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, prompt: str, **generation_kwargs) -> str:
+        blob = json.dumps(
+            {"prompt": prompt, "revision": self.revision, "generation": generation_kwargs},
+            sort_keys=True
+        )
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _db(self):
+        # One connection per process: forked workers must not share a SQLite handle
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, answer TEXT, answer_type TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str):
+        """(answer, answer_type) or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if self.path:
+                try:
+                    row = self._db().execute(
+                        "SELECT answer, answer_type FROM results WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"Result cache read failed: {e}")
+                    row = None
+                if row is not None:
+                    value = (row[0], row[1])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key: str, answer: str, answer_type: str):
+        with self._lock:
+            self._remember(key, (answer, answer_type))
+            if self.path:
+                try:
+                    conn = self._db()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                        (key, answer, answer_type, time.time())
+                    )
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        conn.execute(
+                            "DELETE FROM results WHERE key NOT IN "
+                            "(SELECT key FROM results ORDER BY created_at DESC LIMIT ?)",
+                            (self.disk_maxsize,)
+                        )
+                    conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Result cache write failed: {e}")
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "revision": self.revision,
+            "entries": entries,
+            "persistent": bool(self.path),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
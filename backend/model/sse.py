@@ -0,0 +1,11 @@
+# sse.py
+#
+# Server-sent events framing, shared by the TinyLlama server (/explain/stream)
+# and the backend's voice streams (imported there as model.sse)
+
+import json
+
+def sse_event(data, event=None):
+    """One SSE message: `data` as JSON, under the named event if given"""
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
@@ -0,0 +1,75 @@
+# stopping.py
+
+# Every prompt template asks the model to finish with this line
+SENTINEL = "End of answer."
+
+# Text that commonly surrounds the sentinel; neighbours change how its first
+# word and its final period tokenize (e.g. ".'" is a single token)
+SENTINEL_PREFIXES = ("x", "x ", "x\n", "x'", "x\"", "x:")
+SENTINEL_SUFFIXES = ("", "'", "\"", "\n", " x")
+
+def sentinel_token_variants(tokenizer, text=SENTINEL, prefixes=SENTINEL_PREFIXES, suffixes=SENTINEL_SUFFIXES):
+    """
+    Token id sequences the sentinel can appear as inside generated text.
+    The sentinel is encoded between each prefix/suffix pair and the shortest
+    token span that still decodes to the full sentinel is kept.
+    """
+    variants = set()
+    for before in prefixes:
+        prefix = tokenizer.encode(before, add_special_tokens=False)
+        for after in suffixes:
+            full = tokenizer.encode(before + text + after, add_special_tokens=False)
+            shared = 0
+            while shared < min(len(full), len(prefix)) and full[shared] == prefix[shared]:
+                shared += 1
+            span = full[shared:]
+            if text not in tokenizer.decode(span):
+                continue
+            while len(span) > 1 and text in tokenizer.decode(span[:-1]):
+                span = span[:-1]
+            while len(span) > 1 and text in tokenizer.decode(span[1:]):
+                span = span[1:]
+            variants.add(tuple(span))
+    return sorted(variants)
+
+def _failure_table(pattern):
+    # Standard KMP prefix function
+    table = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = table[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        table[i] = k
+    return table
+
+class StopSequenceMatcher:
+    """
+    Incremental multi-pattern token matcher (one KMP automaton per pattern).
+    feed() is O(1) amortised per token, so it can run inside every decode step.
+    """
+
+    def __init__(self, patterns, _tables=None):
+        self.patterns = [tuple(p) for p in patterns if p]
+        self._tables = _tables or [_failure_table(p) for p in self.patterns]
+        self._state = [0] * len(self.patterns)
+
+    def fresh(self):
+        """A matcher with the same patterns and reset state (one per sequence)"""
+        return StopSequenceMatcher(self.patterns, self._tables)
+
+    def feed(self, token_id) -> bool:
+        """Advance with one generated token; True once any pattern has just completed"""
+        hit = False
+        for i, pattern in enumerate(self.patterns):
+            k = self._state[i]
+            while k and pattern[k] != token_id:
+                k = self._tables[i][k - 1]
+            if pattern[k] == token_id:
+                k += 1
+            if k == len(pattern):
+                hit = True
+                k = self._tables[i][k - 1]
+            self._state[i] = k
+        return hit
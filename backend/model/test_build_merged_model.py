@@ -0,0 +1,91 @@
+# test_build_merged_model.py
+#
+# Run from backend/model: python -m pytest -q test_build_merged_model.py
+# The parity gates of build_merged_model.py and the int8 loader of LLM_app.py,
+# on a tiny randomly initialised Llama with a random LoRA adapter.
+
+import pytest
+import torch
+from peft import LoraConfig, get_peft_model
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from build_merged_model import agreement, greedy_outputs, int8_parity_ok, merged_parity_ok
+from quantization import load_int8_model, quantize_int8
+
+EOS = 2
+PARITY_TOKENS = 12
+
+class CharTokenizer:
+    """One token per character, enough for greedy_outputs"""
+    eos_token_id = EOS
+
+    def __call__(self, text, return_tensors="pt"):
+        ids = torch.tensor([[3 + min(ord(c), 124) for c in text]])
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+
+def tiny_llama():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=128,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=2048,
+        eos_token_id=EOS,
+        pad_token_id=EOS
+    )
+    return LlamaForCausalLM(config).eval()
+
+@pytest.fixture(scope="module")
+def merged():
+    """(unmerged adapter outputs, merged model) as build_merged_model.main produces them"""
+    torch.manual_seed(1)
+    # init_lora_weights=False: random B as well as A, so the adapter actually changes the output
+    lora = LoraConfig(r=8, lora_alpha=16, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    model = get_peft_model(tiny_llama(), lora).eval()
+    reference = greedy_outputs(model, CharTokenizer(), PARITY_TOKENS)
+    return reference, model.merge_and_unload().eval()
+
+def test_agreement_counts_prefix_up_to_first_divergence():
+    assert agreement([[1, 2, 3, 4]], [[1, 2, 3, 4]]) == [1.0]
+    assert agreement([[1, 2, 3, 4]], [[1, 2, 9, 4]]) == [0.5]
+    assert agreement([[1, 2], [5, 6, 7, 8]], [[7, 2], [5, 6, 7]]) == [0.0, 0.75]
+    assert agreement([[]], [[]]) == [0.0]
+
+def test_parity_gates():
+    assert merged_parity_ok([1.0, 1.0])
+    assert not merged_parity_ok([1.0, 0.98])
+    # int8 is gated on the mean, so one early divergence alone doesn't fail the build
+    assert int8_parity_ok([0.2, 1.0, 1.0, 1.0], 0.75)
+    assert not int8_parity_ok([0.2, 0.5, 1.0, 1.0], 0.75)
+
+def test_merged_model_matches_adapter(merged):
+    reference, model = merged
+    assert all(reference)
+    assert reference != greedy_outputs(tiny_llama(), CharTokenizer(), PARITY_TOKENS), "adapter has no effect"
+    assert merged_parity_ok(agreement(reference, greedy_outputs(model, CharTokenizer(), PARITY_TOKENS)))
+
+def test_int8_agreement_is_scored_against_adapter(merged):
+    reference, model = merged
+    scores = agreement(reference, greedy_outputs(quantize_int8(model), CharTokenizer(), PARITY_TOKENS))
+    assert len(scores) == len(reference)
+    assert all(0.0 <= score <= 1.0 for score in scores)
+    assert int8_parity_ok(scores, 0.5)
+    # Quantizing returns a copy; the merged model that gets saved is untouched
+    assert merged_parity_ok(agreement(reference, greedy_outputs(model, CharTokenizer(), PARITY_TOKENS)))
+
+def test_load_int8_model_reproduces_saved_weights(merged, tmp_path):
+    _, model = merged
+    quantized = quantize_int8(model)
+    model.save_pretrained(tmp_path, safe_serialization=True)
+    torch.save(quantized.state_dict(), tmp_path / "int8_state_dict.pt")
+
+    loaded = load_int8_model(str(tmp_path), str(tmp_path / "int8_state_dict.pt")).eval()
+    assert not any(isinstance(m, torch.nn.Linear) for m in loaded.modules())
+
+    input_ids = CharTokenizer()("How does photosynthesis work?")["input_ids"]
+    with torch.no_grad():
+        assert torch.equal(loaded(input_ids).logits, quantized(input_ids).logits)
+    assert greedy_outputs(loaded, CharTokenizer(), PARITY_TOKENS) == greedy_outputs(quantized, CharTokenizer(), PARITY_TOKENS)
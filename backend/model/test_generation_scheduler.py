@@ -0,0 +1,112 @@
+# test_generation_scheduler.py
+#
+# Run from backend/model: python -m pytest -q test_generation_scheduler.py
+# Uses a tiny randomly initialised Llama, so nothing is downloaded.
+
+import asyncio
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from generation_scheduler import GenerationScheduler
+from prefix_cache import PrefixCache
+
+EOS = 2
+REPETITION_PENALTY = 1.1
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=128,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=256,
+        eos_token_id=EOS,
+        pad_token_id=EOS
+    )
+    return LlamaForCausalLM(config).eval()
+
+def reference(model, prompt_ids, max_new_tokens):
+    """What the scheduler must reproduce: one model.generate call per prompt"""
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([prompt_ids]),
+            attention_mask=torch.ones((1, len(prompt_ids)), dtype=torch.long),
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            repetition_penalty=REPETITION_PENALTY,
+            eos_token_id=EOS,
+            pad_token_id=EOS
+        )
+    return output[0, len(prompt_ids):].tolist()
+
+def prompts():
+    generator = torch.Generator().manual_seed(1)
+    # Different lengths so rows are left-padded against each other
+    return [torch.randint(3, 128, (length,), generator=generator).tolist() for length in (5, 11, 17, 8, 23)]
+
+async def run_scheduler(scheduler, jobs, stagger: float = 0.0):
+    handles = []
+    for prompt_ids, max_new_tokens, prefix_len in jobs:
+        handles.append(scheduler.submit(prompt_ids, max_new_tokens, prefix_len=prefix_len))
+        if stagger:
+            # Later prompts join a batch that is already decoding
+            await asyncio.sleep(stagger)
+    return await asyncio.wait_for(asyncio.gather(*(h.result() for h in handles)), timeout=120)
+
+def test_batched_output_matches_generate(model):
+    jobs = [(prompt_ids, 12 + index, 0) for index, prompt_ids in enumerate(prompts())]
+    scheduler = GenerationScheduler(model, None, max_batch_size=3, repetition_penalty=REPETITION_PENALTY, eos_token_id=EOS)
+    scheduler.start()
+    try:
+        results = asyncio.run(run_scheduler(scheduler, jobs, stagger=0.01))
+    finally:
+        scheduler.stop()
+    for (prompt_ids, max_new_tokens, _), tokens in zip(jobs, results):
+        assert tokens == reference(model, prompt_ids, max_new_tokens)
+
+def test_prefix_cached_output_matches_generate(model):
+    preamble = [7, 19, 33, 41, 58, 64]
+    jobs = [(preamble + prompt_ids, 10, len(preamble)) for prompt_ids in prompts()[:3]]
+    scheduler = GenerationScheduler(
+        model, None, max_batch_size=4, repetition_penalty=REPETITION_PENALTY, eos_token_id=EOS,
+        prefix_cache=PrefixCache(model, maxsize=2)
+    )
+    scheduler.start()
+    try:
+        results = asyncio.run(run_scheduler(scheduler, jobs))
+    finally:
+        scheduler.stop()
+    for (prompt_ids, max_new_tokens, _), tokens in zip(jobs, results):
+        assert tokens == reference(model, prompt_ids, max_new_tokens)
+    assert scheduler.stats()["prefix_cache"]["hits"] >= 2
+
+def test_prefill_failure_settles_handles(model):
+    scheduler = GenerationScheduler(model, None, max_batch_size=4, repetition_penalty=REPETITION_PENALTY, eos_token_id=EOS)
+
+    def broken_prefill(handles):
+        raise RuntimeError("prefill exploded")
+
+    scheduler._prefill_batch = broken_prefill
+    scheduler.start()
+    try:
+        with pytest.raises(RuntimeError, match="prefill exploded"):
+            asyncio.run(run_scheduler(scheduler, [(prompts()[0], 5, 0)]))
+    finally:
+        scheduler.stop()
+
+def test_stop_fails_queued_handles(model):
+    scheduler = GenerationScheduler(model, None, max_batch_size=4, repetition_penalty=REPETITION_PENALTY, eos_token_id=EOS)
+
+    async def submit_then_stop():
+        handle = scheduler.submit(prompts()[0], 5)
+        scheduler.stop()  # never started: the handle is still queued
+        return await asyncio.wait_for(handle.result(), timeout=5)
+
+    with pytest.raises(RuntimeError, match="stopped"):
+        asyncio.run(submit_then_stop())
@@ -0,0 +1,81 @@
+# response_cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache with per-entry expiry.
+    Thread-safe so it can be shared by async handlers and worker threads.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 3600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                metrics.inc(f"cache.{self.name}.misses")
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                metrics.inc(f"cache.{self.name}.misses")
+                return default
+            self._data.move_to_end(key)
+        metrics.inc(f"cache.{self.name}.hits")
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+
+    def __contains__(self, key):
+        """Live-entry check that doesn't count as a hit or miss"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+# Results of /ask/ keyed by query_id, so follow-up calls (voice explanation)
+# can reuse the detailed answer and image without another LLM round trip
+query_results = TTLCache(
+    "query_results",
+    maxsize=int(os.getenv("QUERY_RESULT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("QUERY_RESULT_CACHE_TTL", "3600"))
+)
+
+def normalize_query(text: str) -> str:
+    """Case, whitespace and trailing punctuation don't change the answer (matches db.get_frequent_queries)"""
+    return " ".join(text.lower().split()).rstrip("?.! ")
+
+def answer_key(query_text: str, sentiment_label: str, language: str = "en") -> str:
+    return f"{normalize_query(query_text)}|{(sentiment_label or '').upper()}|{language or 'en'}"
+
+# /ask/ answers for questions asked without session context, keyed by answer_key();
+# filled by live traffic and by answer_warming.py from the most common past questions
+answers = TTLCache(
+    "answers",
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+)
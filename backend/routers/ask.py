@@ -6,18 +6,38 @@ from uuid import uuid4
 from datetime import datetime
 import uuid
 
-from groq_client import (
-    get_groq_response, 
-    get_simplified_response, 
-    get_detailed_response, 
+from groq_async_client import (
+    GROQ_DETAILED_SYSTEM_PROMPT,
+    GROQ_SIMPLIFIED_SYSTEM_PROMPT,
+    GroqUnavailableError,
+    get_groq_response,
+    get_simplified_response,
+    get_detailed_response,
     get_voice_explanation_response
 )
-from db import save_query_to_db, get_session_context
+from db import save_query_to_db, get_session_context, get_query_by_id
+from response_cache import query_results, answers, answer_key
 from auth import get_current_user
+from singleflight import llm_singleflight, prompt_key
+from deadline import Deadline, DeadlineExceeded
+from llm_hedging import hedged_generate, PRIMARY_BACKEND, HEDGE_BACKEND
+from tinyllama_client import get_tinyllama_response_async
 from .image_generator import get_image_for_query
+from voice_prefetch import schedule_voice_prefetch
 
 router = APIRouter()
 
+CACHE_BACKEND = "cache"
+
+def empty_image_data() -> dict:
+    # A fresh dict each time: responses and cached results must not share one
+    return {
+        "image_url": None,
+        "image_type": None,
+        "svg_code": None,
+        "explanations": []
+    }
+
 class AskRequest(BaseModel):
     session_id: str
     chat_id: str
@@ -27,48 +47,108 @@ class AskRequest(BaseModel):
     sentiment_label: str  # POSITIVE, NEUTRAL, NEGATIVE
     sentiment_score: float
     language: str = "en"
+    query_id: str = None  # voice-explanation: reuse the stored answer for this query
+
+def build_tutor_prompt(query_text: str, sentiment_label: str, context_str: str = "") -> str:
+    return f"""You are a friendly, emotionally intelligent STEM tutor.
+The student is feeling {sentiment_label.lower()}.
+
+{context_str}
+
+Now answer this:
+Q: {query_text}
+"""
 
 @router.post("/ask/")
-async def ask_groq(request: AskRequest, user=Depends(get_current_user)):
+async def ask_groq(request: AskRequest, http_request: Request, user=Depends(get_current_user)):
     try:
         user_id = user["sub"]  # Supabase UUID of logged-in user
-        
+
+        # Request budget; when it runs low optional stages are skipped in order:
+        # image lookup first, then the detailed answer, then context expansion
+        deadline = Deadline.from_header(http_request.headers.get("X-Request-Deadline"))
+
         # Get previous queries in the session
-        context = get_session_context(request.session_id)
+        if deadline.can_afford("context", reserve=deadline.estimate("simplified")):
+            with deadline.timed("context"):
+                context = get_session_context(request.session_id)
+        else:
+            deadline.degrade("context")
+            context = []
         context_str = "\n".join(context)
 
         # Simple Groq-only pipeline 
-        full_prompt = f"""You are a friendly, emotionally intelligent STEM tutor.
-The student is feeling {request.sentiment_label.lower()}.
+        full_prompt = build_tutor_prompt(request.query_text, request.sentiment_label, context_str)
 
-{context_str}
+        # Without session context the prompt depends only on the question, sentiment and
+        # language, so the answer can be shared (and pre-generated by answer_warming.py)
+        cache_key = None if context else answer_key(request.query_text, request.sentiment_label, request.language)
+        cached_answer = answers.get(cache_key) if cache_key else None
 
-Now answer this:
-Q: {request.query_text}
-"""
-        
         # Get simple and detailed responses from Groq
-        try:
-            groq_simple = get_simplified_response(full_prompt)
-            groq_main = get_detailed_response(full_prompt)
-        except Exception as e:
-            groq_main = get_groq_response(full_prompt)
-            groq_simple = get_groq_response(f"Explain this briefly in 2-3 sentences:\n{groq_main}")
+        # Identical prompts in flight at the same time share one upstream generation,
+        # and a slow Groq call is hedged against the local TinyLlama server. The hedge gets
+        # what full_prompt carries (session context) plus the same answer-style instructions
+        # Groq gets for that call, so the simplified and detailed hedges differ
+        def tinyllama_hedge(instructions):
+            def hedge():
+                return get_tinyllama_response_async(
+                    request.query_text,
+                    request.sentiment_label,
+                    deadline=deadline,
+                    context=context_str,
+                    instructions=instructions
+                )
+            return hedge
+
+        if cached_answer:
+            groq_simple, groq_main = cached_answer["simplified"], cached_answer["detailed"]
+            simple_backend = main_backend = CACHE_BACKEND
+        else:
+            try:
+                groq_simple, simple_backend = await deadline.run("simplified", llm_singleflight.do(
+                    prompt_key("simplified", full_prompt), hedged_generate, "simplified", get_simplified_response, full_prompt, tinyllama_hedge(GROQ_SIMPLIFIED_SYSTEM_PROMPT)
+                ))
+                groq_main, main_backend = groq_simple, simple_backend
+                if deadline.can_afford("detailed"):
+                    try:
+                        groq_main, main_backend = await deadline.run("detailed", llm_singleflight.do(
+                            prompt_key("detailed", full_prompt), hedged_generate, "detailed", get_detailed_response, full_prompt, tinyllama_hedge(GROQ_DETAILED_SYSTEM_PROMPT)
+                        ))
+                    except DeadlineExceeded:
+                        deadline.degrade("detailed")
+                    else:
+                        if main_backend == HEDGE_BACKEND and groq_main == groq_simple:
+                            # A hedged "detailed" answer that adds nothing over the simplified one
+                            deadline.degrade("detailed")
+                else:
+                    deadline.degrade("detailed")
+            except (GroqUnavailableError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                groq_main = await deadline.run("fallback", llm_singleflight.do(prompt_key("groq", full_prompt), get_groq_response, full_prompt))
+                brief_prompt = f"Explain this briefly in 2-3 sentences:\n{groq_main}"
+                groq_simple = await deadline.run("fallback", llm_singleflight.do(prompt_key("groq", brief_prompt), get_groq_response, brief_prompt))
+                simple_backend = main_backend = PRIMARY_BACKEND
+
+            # Only full Groq answers are shared; hedged or degraded ones are one-offs
+            if cache_key and "detailed" not in deadline.degraded and simple_backend == main_backend == PRIMARY_BACKEND:
+                answers.set(cache_key, {"simplified": groq_simple, "detailed": groq_main})
 
         # Save query to DB
         query_id = str(uuid4())
         
         # Get image for the query
-        try:
-            image_data = get_image_for_query(request.query_text, query_id)
-        except Exception as e:
-            # If image generation fails, continue without image
-            image_data = {
-                "image_url": None,
-                "image_type": None,
-                "svg_code": None,
-                "explanations": []
-            }
+        if deadline.can_afford("image"):
+            try:
+                with deadline.timed("image"):
+                    image_data = get_image_for_query(request.query_text, query_id)
+            except Exception as e:
+                # If image generation fails, continue without image
+                image_data = empty_image_data()
+        else:
+            deadline.degrade("image")
+            image_data = empty_image_data()
         
         save_query_to_db({
             "id": query_id,
@@ -79,7 +159,7 @@ Q: {request.query_text}
             "transcript": request.transcript,
             "sentiment_label": request.sentiment_label,
             "sentiment_score": request.sentiment_score,
-            "tinyllama_response": None,  # No TinyLlama response
+            "tinyllama_response": groq_main if main_backend == HEDGE_BACKEND else None,
             "groq_response_main": groq_main,
             "groq_response_simplified": groq_simple,
             "response_language": request.language,
@@ -95,10 +175,34 @@ Q: {request.query_text}
             "image_data": image_data  # Include image data
         }
         
-        response_data["pipeline"] = "Groq only"
+        # Keep the answer and image around for the follow-up voice explanation
+        if "detailed" not in deadline.degraded:
+            query_results.set(query_id, {
+                "user_id": user_id,
+                "query_text": request.query_text,
+                "detailed_response": groq_main,
+                "image_data": image_data
+            })
+
+        response_data["answered_by"] = {"simplified": simple_backend, "detailed": main_backend}
+        if simple_backend == main_backend == CACHE_BACKEND:
+            response_data["pipeline"] = "Cached answer"
+        elif simple_backend == main_backend == PRIMARY_BACKEND:
+            response_data["pipeline"] = "Groq only"
+        else:
+            response_data["pipeline"] = "Groq + TinyLlama hedge"
+        response_data["degraded"] = deadline.degraded
+
+        # Most answers are listened to next; with VOICE_PREFETCH_ENABLED the clip is
+        # synthesized in the background so the listen button finds it ready
+        schedule_voice_prefetch(groq_main, user_id, request.session_id, query_id)
 
         return response_data
 
+    except GroqUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -110,7 +214,20 @@ async def get_voice_explanation(request: AskRequest, user=Depends(get_current_us
     """
     try:
         user_id = user["sub"]
-        
+
+        # Serve the detailed answer /ask/ already produced for this query, if we have it
+        if request.query_id:
+            stored = get_stored_query_result(request.query_id, user_id)
+            if stored:
+                return {
+                    "voice_explanation": stored["detailed_response"],
+                    "query_text": stored["query_text"],
+                    "query_id": request.query_id,
+                    "sentiment": request.sentiment_label,
+                    "pipeline": f"Stored answer ({stored['source']})",
+                    "image_data": stored["image_data"]
+                }
+
         # Get previous queries in the session for context
         context = get_session_context(request.session_id)
         context_str = "\n".join(context)
@@ -126,20 +243,15 @@ Now provide a thorough explanation for:
 Q: {request.query_text}
 """
         try:
-            voice_explanation = get_voice_explanation_response(full_prompt)
+            voice_explanation = await llm_singleflight.do(prompt_key("voice", full_prompt), get_voice_explanation_response, full_prompt)
         except Exception as e:
-            voice_explanation = get_detailed_response(full_prompt)
+            voice_explanation = await llm_singleflight.do(prompt_key("detailed", full_prompt), get_detailed_response, full_prompt)
 
         # Get image for the query (for voice explanation as well)
         try:
-            image_data = get_image_for_query(request.query_text)
+            image_data = get_image_for_query(request.query_text, request.query_id)
         except Exception as e:
-            image_data = {
-                "image_url": None,
-                "image_type": None,
-                "svg_code": None,
-                "explanations": []
-            }
+            image_data = empty_image_data()
 
         response_data = {
             "voice_explanation": voice_explanation,
@@ -151,5 +263,36 @@ Q: {request.query_text}
 
         return response_data
 
+    except GroqUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+def get_stored_query_result(query_id: str, user_id: str):
+    """
+    Look up the detailed answer and image for a previous /ask/ call:
+    in-process cache first, then the queries table. Returns None on a miss.
+    """
+    cached = query_results.get(query_id)
+    if cached and cached["user_id"] == user_id:
+        return {**cached, "source": "cache"}
+
+    row = get_query_by_id(query_id, user_id)
+    # A main answer equal to the simplified one means the detailed stage was degraded
+    if not row or not row["groq_response_main"] or row["groq_response_main"] == row["groq_response_simplified"]:
+        return None
+
+    # The image isn't persisted with the query; the lookup is local and cheap
+    try:
+        image_data = get_image_for_query(row["query_text"], query_id)
+    except Exception as e:
+        image_data = empty_image_data()
+
+    result = {
+        "user_id": user_id,
+        "query_text": row["query_text"],
+        "detailed_response": row["groq_response_main"],
+        "image_data": image_data
+    }
+    query_results.set(query_id, result)
+    return {**result, "source": "db"}
@@ -3,9 +3,10 @@ from pydantic import BaseModel
 import tempfile, os, uuid
 from datetime import datetime
 
-from groq_client import transcribe_with_whisper
+from groq_async_client import transcribe_with_whisper, get_simplified_response, get_detailed_response
 from db import get_sentiment_from_text, save_query_to_db, get_session_context, save_standalone_query_to_db
 from auth import get_current_user
+from singleflight import llm_singleflight, prompt_key
 
 router = APIRouter()
 
@@ -104,7 +105,7 @@ async def audio_to_sentiment(file: UploadFile = File(...), user=Depends(get_curr
 
     try:
         # Transcribe audio using Groq Whisper
-        transcript = transcribe_with_whisper(local_audio_path).strip()
+        transcript = (await transcribe_with_whisper(local_audio_path)).strip()
         print(f"[AUDIO DEBUG] Transcript: {transcript[:100]}...")
 
         # Analyze sentiment
@@ -112,10 +113,9 @@ async def audio_to_sentiment(file: UploadFile = File(...), user=Depends(get_curr
         print(f"[AUDIO DEBUG] Sentiment: {sentiment_label}, Score: {sentiment_score}")
 
         # --- Get Groq chat responses (both simplified and detailed) ---
-        from groq_client import get_simplified_response, get_detailed_response
         try:
-            groq_response_simplified = get_simplified_response(transcript)
-            groq_response_main = get_detailed_response(transcript)
+            groq_response_simplified = await llm_singleflight.do(prompt_key("simplified", transcript), get_simplified_response, transcript)
+            groq_response_main = await llm_singleflight.do(prompt_key("detailed", transcript), get_detailed_response, transcript)
         except Exception as e:
             groq_response_simplified = f"[Groq error: {e}]"
             groq_response_main = f"[Groq error: {e}]"
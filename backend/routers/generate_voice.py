@@ -1,17 +1,29 @@
 # routers/generate_voice.py
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import uuid
+import asyncio
+import base64
 import os
 import logging
-import shutil
-import time
-import glob
+from contextlib import contextmanager
 
-from google_tts import synthesize_with_timings
-from supabase_client import upload_audio_to_supabase, AUDIO_STORAGE_DIR, STATIC_DIR
+from tts_chunking import (
+    TTS_FIRST_CHUNK_BYTES,
+    clip_duration,
+    shift_timings,
+    split_text_for_tts,
+    synthesize_chunked,
+    synthesize_chunks_in_order
+)
+from tts_backends import profile_content_type, profile_extension, resolve_voice_output
+from tts_cache import tts_cache, tts_cache_key
+from supabase_client import publish_audio, AUDIO_STORAGE_DIR
+from audio_index import audio_index
 from auth import get_current_user
+from singleflight import SingleFlight
+from model.sse import sse_event
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,44 +31,24 @@ logger = logging.getLogger("generate_voice")
 
 router = APIRouter()
 
-def truncate_text_to_byte_limit(text: str, max_bytes: int = 4800) -> str:
-    """
-    Truncate text to fit within Google TTS byte limit while preserving sentence boundaries.
-    """
-    text_bytes = text.encode('utf-8')
-    if len(text_bytes) <= max_bytes:
-        return text
-    
-    logger.warning(f"Text is {len(text_bytes)} bytes, which exceeds Google TTS limit. Truncating...")
-    
-    # Binary search to find the longest text that fits within the limit
-    left, right = 0, len(text)
-    best_text = text[:3000]  # fallback
-    
-    while left <= right:
-        mid = (left + right) // 2
-        test_text = text[:mid]
-        
-        # Try to end at a sentence boundary for better quality
-        last_period = test_text.rfind('.')
-        last_exclamation = test_text.rfind('!')
-        last_question = test_text.rfind('?')
-        sentence_end = max(last_period, last_exclamation, last_question)
-        
-        if sentence_end > mid - 200:  # If we found a sentence end nearby
-            test_text = test_text[:sentence_end + 1]
-        
-        test_bytes = test_text.encode('utf-8')
-        
-        if len(test_bytes) <= max_bytes:
-            best_text = test_text
-            left = mid + 1
-        else:
-            right = mid - 1
-    
-    original_length = len(text)
-    logger.warning(f"Text truncated from {original_length} to {len(best_text)} characters ({len(best_text.encode('utf-8'))} bytes)")
-    return best_text
+# Concurrent requests for the same clip (e.g. a listen click while voice_prefetch
+# is synthesizing that answer) share one synthesis
+tts_singleflight = SingleFlight("tts")
+
+# Syntheses users are waiting on; background prefetching holds off while any run
+_interactive_syntheses = 0
+
+@contextmanager
+def interactive_synthesis():
+    global _interactive_syntheses
+    _interactive_syntheses += 1
+    try:
+        yield
+    finally:
+        _interactive_syntheses -= 1
+
+def interactive_syntheses() -> int:
+    return _interactive_syntheses
 
 class VoiceRequest(BaseModel):
     text: str
@@ -65,6 +57,89 @@ class VoiceRequest(BaseModel):
     session_id: str = None  # Optional session ID for organization
     query_id: str = None  # Optional query ID for easy retrieval
     chat_id: str = None  # Optional chat ID for organization
+    backend: str = None  # TTS engine: 'google' or 'local' (defaults to TTS_BACKEND)
+    profile: str = None  # Output: 'mp3', 'mp3_low', 'opus' or 'linear16' (defaults to TTS_AUDIO_PROFILE)
+
+def voice_output(data: VoiceRequest):
+    """(backend, profile) for the request; 400 for unknown or unsupported choices"""
+    try:
+        return resolve_voice_output(data.backend, data.profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def voice_cache_key(data: VoiceRequest) -> str:
+    """TTS cache key of the clip this request produces"""
+    backend, profile = resolve_voice_output(data.backend, data.profile)
+    return tts_cache_key(data.text, data.language_code, data.voice_name, profile, backend.name)
+
+def voice_target_path(key: str, extension: str = ".mp3", user_id: str = None, session_id: str = None, query_id: str = None) -> str:
+    """
+    Storage path for a clip, organized by user/session/query (voice_test/ without a user).
+    Named after the cache key, so publishing the same clip again reuses the same link.
+    """
+    file_id = key[:16]
+    if user_id is None:
+        return f"voice_test/{key}{extension}"
+    if query_id:
+        if session_id:
+            return f"voice_explanations/{user_id}/session_{session_id}/query_{query_id}_{file_id}{extension}"
+        return f"voice_explanations/{user_id}/query_{query_id}_{file_id}{extension}"
+    if session_id:
+        return f"voice_explanations/{user_id}/session_{session_id}/{file_id}{extension}"
+    return f"voice_explanations/{user_id}/{file_id}{extension}"
+
+def publish_clip(key: str, audio_path: str, timings, user_id: str = None, session_id: str = None, query_id: str = None) -> str:
+    """Publish a cached clip under its organized path and index it by query for /voice/audio"""
+    target_path = voice_target_path(key, os.path.splitext(audio_path)[1], user_id, session_id, query_id)
+    file_path = os.path.join(AUDIO_STORAGE_DIR, *target_path.split('/'))
+    # Tracked by the cache so evicting the clip removes this link (and its index entry) too
+    tts_cache.track_link(key, file_path)
+    audio_url = publish_audio(audio_path, target_path)
+    if user_id and query_id:
+        audio_index.record(user_id, query_id, session_id, audio_url, file_path, timings)
+    return audio_url
+
+def publish_voice(audio_path: str, timings, data: VoiceRequest, user_id: str = None) -> str:
+    return publish_clip(voice_cache_key(data), audio_path, timings, user_id, data.session_id, data.query_id)
+
+def index_voice(audio_path: str, timings, data: VoiceRequest, user_id: str):
+    """
+    Index a cached clip by query without publishing it (voice_prefetch: nobody may
+    ever play it). /voice/audio publishes it the first time it is asked for.
+    """
+    if user_id and data.query_id:
+        audio_index.record_unpublished(user_id, data.query_id, data.session_id, audio_path, timings)
+
+async def synthesize_cached(data: VoiceRequest, background: bool = False):
+    """
+    Audio path and timings for the request, plus whether they came from the TTS cache.
+    Freshly synthesized audio is written once, into the cache; the path is that cached file.
+    Pass background=True for speculative work nobody is waiting on yet.
+    """
+    backend, profile = resolve_voice_output(data.backend, data.profile)
+    key = voice_cache_key(data)
+    # Cache, index and link calls touch the disk; they run in threads to keep the loop free
+    cached = await asyncio.to_thread(tts_cache.get, key)
+    if cached is not None:
+        logger.info(f"TTS cache hit: {key[:12]}")
+        return cached[0], cached[1], True
+
+    async def synthesize():
+        audio, timings = await synthesize_chunked(
+            data.text,
+            language_code=data.language_code,
+            voice_name=data.voice_name,
+            backend=backend.name,
+            profile=profile
+        )
+        return await asyncio.to_thread(tts_cache.put, key, audio, timings, profile_extension(profile)), timings
+
+    if background:
+        audio_path, timings = await tts_singleflight.do(key, synthesize)
+    else:
+        with interactive_synthesis():
+            audio_path, timings = await tts_singleflight.do(key, synthesize)
+    return audio_path, timings, False
 
 @router.post("/voice/generate")
 async def generate_voice(data: VoiceRequest, user=Depends(get_current_user)):
@@ -82,53 +157,29 @@ async def generate_voice(data: VoiceRequest, user=Depends(get_current_user)):
         # Validate input
         if not data.text or len(data.text.strip()) == 0:
             raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
-        # Truncate text if it exceeds Google TTS byte limit
-        data.text = truncate_text_to_byte_limit(data.text)
-        
-        # 1. Generate TTS audio and timings
-        try:
-            audio_path, timings = synthesize_with_timings(
-                data.text, 
-                language_code=data.language_code,
-                voice_name=data.voice_name
-            )
-            logger.info(f"Successfully generated audio at: {audio_path}")
-            logger.info(f"Generated {len(timings)} timing segments")
-        except Exception as tts_error:
-            logger.error(f"TTS generation failed: {tts_error}")
-            raise HTTPException(status_code=500, detail=f"Voice generation failed: {str(tts_error)}")
-        
-        # 2. Save audio file and get URL
-        try:
-            file_id = str(uuid.uuid4())
-            
-            # Create organized path with session/query IDs if provided
-            if data.query_id:
-                if data.session_id:
-                    target_path = f"voice_explanations/{user_id}/session_{data.session_id}/query_{data.query_id}_{file_id}.mp3"
-                else:
-                    target_path = f"voice_explanations/{user_id}/query_{data.query_id}_{file_id}.mp3"
-            elif data.session_id:
-                target_path = f"voice_explanations/{user_id}/session_{data.session_id}/{file_id}.mp3"
-            else:
-                target_path = f"voice_explanations/{user_id}/{file_id}.mp3"
-            
-            audio_url = upload_audio_to_supabase(audio_path, target_path)
-            logger.info(f"Audio saved successfully. URL: {audio_url}")
-        except Exception as upload_error:
-            logger.error(f"Error saving audio file: {upload_error}")
-            raise HTTPException(status_code=500, detail=f"Failed to save audio: {str(upload_error)}")
-        
-        # 3. Clean up temporary file
-        try:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-                logger.info("Temporary file cleaned up")
-        except Exception as cleanup_error:
-            logger.warning(f"Failed to clean up temp file: {cleanup_error}")
-
-        # 4. Return response
+        backend, profile = voice_output(data)
+        
+        # Pinned from the cache lookup until the clip is published, so eviction can't remove it in between
+        with tts_cache.pinned(voice_cache_key(data)):
+            # 1. Generate TTS audio and timings (cached by text and voice; long text is synthesized in parallel chunks)
+            try:
+                audio_path, timings, cached = await synthesize_cached(data)
+                logger.info(f"Audio ready at: {audio_path} (cached: {cached})")
+                logger.info(f"Generated {len(timings)} timing segments")
+            except Exception as tts_error:
+                logger.error(f"TTS generation failed: {tts_error}")
+                raise HTTPException(status_code=500, detail=f"Voice generation failed: {str(tts_error)}")
+        
+            # 2. Save audio file and get URL
+            try:
+                # Organized path with session/query IDs if provided
+                audio_url = await asyncio.to_thread(publish_voice, audio_path, timings, data, user_id)
+                logger.info(f"Audio saved successfully. URL: {audio_url}")
+            except Exception as upload_error:
+                logger.error(f"Error saving audio file: {upload_error}")
+                raise HTTPException(status_code=500, detail=f"Failed to save audio: {str(upload_error)}")
+        
+        # 3. Return response
         response = {
             "success": True,
             "audio_url": audio_url,
@@ -137,7 +188,11 @@ async def generate_voice(data: VoiceRequest, user=Depends(get_current_user)):
                 "text_length": len(data.text),
                 "language_code": data.language_code,
                 "voice_name": data.voice_name,
-                "segments_count": len(timings)
+                "backend": backend.name,
+                "profile": profile,
+                "content_type": profile_content_type(profile),
+                "segments_count": len(timings),
+                "cached": cached
             }
         }
         
@@ -167,43 +222,28 @@ async def generate_voice_test(data: VoiceRequest):
         # Validate input
         if not data.text or len(data.text.strip()) == 0:
             raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
-        # Truncate text if it exceeds Google TTS byte limit
-        data.text = truncate_text_to_byte_limit(data.text)
-        
-        # 1. Generate TTS audio and timings
-        try:
-            audio_path, timings = synthesize_with_timings(
-                data.text, 
-                language_code=data.language_code,
-                voice_name=data.voice_name
-            )
-            logger.info(f"Successfully generated audio at: {audio_path}")
-            logger.info(f"Generated {len(timings)} timing segments")
-        except Exception as tts_error:
-            logger.error(f"TTS generation failed: {tts_error}")
-            raise HTTPException(status_code=500, detail=f"Voice generation failed: {str(tts_error)}")
-        
-        # 2. Save audio file and get URL
-        try:
-            file_id = str(uuid.uuid4())
-            target_path = f"voice_test/{file_id}.mp3"
-            
-            audio_url = upload_audio_to_supabase(audio_path, target_path)
-            logger.info(f"Audio saved successfully. URL: {audio_url}")
-        except Exception as upload_error:
-            logger.error(f"Error saving audio file: {upload_error}")
-            raise HTTPException(status_code=500, detail=f"Failed to save audio: {str(upload_error)}")
-        
-        # 3. Clean up temporary file
-        try:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-                logger.info("Temporary file cleaned up")
-        except Exception as cleanup_error:
-            logger.warning(f"Failed to clean up temp file: {cleanup_error}")
-
-        # 4. Return response
+        backend, profile = voice_output(data)
+        
+        # Pinned from the cache lookup until the clip is published, so eviction can't remove it in between
+        with tts_cache.pinned(voice_cache_key(data)):
+            # 1. Generate TTS audio and timings (cached by text and voice; long text is synthesized in parallel chunks)
+            try:
+                audio_path, timings, cached = await synthesize_cached(data)
+                logger.info(f"Audio ready at: {audio_path} (cached: {cached})")
+                logger.info(f"Generated {len(timings)} timing segments")
+            except Exception as tts_error:
+                logger.error(f"TTS generation failed: {tts_error}")
+                raise HTTPException(status_code=500, detail=f"Voice generation failed: {str(tts_error)}")
+        
+            # 2. Save audio file and get URL
+            try:
+                audio_url = await asyncio.to_thread(publish_voice, audio_path, timings, data)
+                logger.info(f"Audio saved successfully. URL: {audio_url}")
+            except Exception as upload_error:
+                logger.error(f"Error saving audio file: {upload_error}")
+                raise HTTPException(status_code=500, detail=f"Failed to save audio: {str(upload_error)}")
+        
+        # 3. Return response
         response = {
             "success": True,
             "audio_url": audio_url,
@@ -212,7 +252,11 @@ async def generate_voice_test(data: VoiceRequest):
                 "text_length": len(data.text),
                 "language_code": data.language_code,
                 "voice_name": data.voice_name,
-                "segments_count": len(timings)
+                "backend": backend.name,
+                "profile": profile,
+                "content_type": profile_content_type(profile),
+                "segments_count": len(timings),
+                "cached": cached
             }
         }
         
@@ -228,6 +272,116 @@ async def generate_voice_test(data: VoiceRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Internal server error during voice generation")
 
+def read_audio(audio_path: str) -> bytes:
+    with open(audio_path, "rb") as f:
+        return f.read()
+
+def read_cached_clip(key: str):
+    """(audio_path, timings, audio bytes) for a cached clip, or None"""
+    cached = tts_cache.get(key)
+    if cached is None:
+        return None
+    audio_path, timings = cached
+    return audio_path, timings, read_audio(audio_path)
+
+def audio_event(index: int, audio: bytes, timings):
+    return sse_event({"index": index, "audio": base64.b64encode(audio).decode("ascii"), "timings": timings}, event="audio")
+
+async def stream_voice(data: VoiceRequest, user_id: str = None):
+    """
+    Server-sent events for one clip: `meta` (chunk count, content type), one
+    `audio` event per chunk in playback order (base64 audio in the requested
+    profile's encoding plus that chunk's timings, already offset), then `done` with the stored clip's URL
+    and the full timings. The first chunk is a short one so playback starts early.
+    """
+    try:
+        backend, profile = resolve_voice_output(data.backend, data.profile)
+        content_type = profile_content_type(profile)
+        key = voice_cache_key(data)
+        with tts_cache.pinned(key):
+            cached = await asyncio.to_thread(read_cached_clip, key)
+            joined = tts_singleflight.join(key) if cached is None else None
+            if cached is not None:
+                audio_path, timings, audio = cached
+                yield sse_event({"chunks": 1, "content_type": content_type, "cached": True}, event="meta")
+                yield audio_event(0, audio, timings)
+            elif joined is not None:
+                # Already being synthesized (e.g. by voice_prefetch): send it whole once it's done
+                yield sse_event({"chunks": 1, "content_type": content_type, "cached": False}, event="meta")
+                audio_path, timings = await joined
+                yield audio_event(0, await asyncio.to_thread(read_audio, audio_path), timings)
+            else:
+                # In flight under the clip's key, so a prefetch of it joins this synthesis
+                flight = tts_singleflight.lead(key)
+                try:
+                    chunks = split_text_for_tts(data.text, first_chunk_bytes=TTS_FIRST_CHUNK_BYTES)
+                    yield sse_event({"chunks": len(chunks), "content_type": content_type, "cached": False}, event="meta")
+                    parts, timings, offset = [], [], 0.0
+                    with interactive_synthesis():
+                        async for index, chunk_audio, chunk_timings in synthesize_chunks_in_order(chunks, data.language_code, data.voice_name, backend.name, profile):
+                            shifted = shift_timings(chunk_timings, offset)
+                            offset += clip_duration(chunk_timings)
+                            parts.append(chunk_audio)
+                            timings += shifted
+                            yield audio_event(index, chunk_audio, shifted)
+                    audio_path = await asyncio.to_thread(tts_cache.put, key, backend.join(parts, profile), timings, profile_extension(profile))
+                    flight.set_result((audio_path, timings))
+                except BaseException as e:
+                    # Includes the client going away mid-stream: joined callers must not hang
+                    flight.set_exception(e if isinstance(e, Exception) else RuntimeError("Voice stream closed before the clip was synthesized"))
+                    raise
+
+            audio_url = await asyncio.to_thread(publish_voice, audio_path, timings, data, user_id)
+        yield sse_event({"audio_url": audio_url, "timings": timings, "segments_count": len(timings)}, event="done")
+    except Exception as e:
+        logger.error(f"Streaming voice generation failed: {e}")
+        yield sse_event({"error": str(e)}, event="error")
+
+def voice_stream_response(data: VoiceRequest, user_id: str = None):
+    if not data.text or len(data.text.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    voice_output(data)
+    return StreamingResponse(
+        stream_voice(data, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/voice/stream")
+async def generate_voice_stream(data: VoiceRequest, user=Depends(get_current_user)):
+    """
+    Streaming variant of /voice/generate: audio is sent sentence chunk by chunk
+    as it is synthesized instead of after the whole clip is ready.
+    """
+    return voice_stream_response(data, user["sub"])
+
+@router.post("/voice/stream-test")
+async def generate_voice_stream_test(data: VoiceRequest):
+    """
+    Streaming voice generation without authentication (development only)
+    """
+    return voice_stream_response(data)
+
+def indexed_clip(user_id: str, query_id: str):
+    """
+    (index entry, file size) for the query's clip, publishing a prefetched clip on
+    first use; None (and the entry dropped) if its file is gone.
+    """
+    clip = audio_index.lookup(user_id, query_id)
+    if clip is None:
+        return None
+    try:
+        if not clip["audio_url"]:
+            key = tts_cache.key_for_path(clip["file_path"])
+            with tts_cache.pinned(key):
+                publish_clip(key, clip["file_path"], clip["timings"], user_id, clip["session_id"], query_id)
+            clip = audio_index.lookup(user_id, query_id)
+        return clip, os.path.getsize(clip["file_path"])
+    except (OSError, ValueError):
+        # Evicted from the cache (or unpublished entry outside it)
+        audio_index.forget(user_id, query_id)
+        return None
+
 @router.get("/voice/audio")
 async def get_audio_by_query_id(query_id: str, session_id: str = None, user=Depends(get_current_user)):
     """
@@ -236,61 +390,25 @@ async def get_audio_by_query_id(query_id: str, session_id: str = None, user=Depe
     try:
         user_id = user["sub"]
         logger.info(f"Retrieving audio for query_id: {query_id}, session_id: {session_id}, user: {user_id}")
-        
-        # Search for the audio file in the organized directory structure
-        base_search_dir = os.path.join(AUDIO_STORAGE_DIR, f"voice_explanations/{user_id}")
-        
-        if not os.path.exists(base_search_dir):
-            raise HTTPException(status_code=404, detail="No audio files found for this user")
-        
-        # Search patterns based on available information
-        search_patterns = []
-        
-        if session_id:
-            # Look in session-specific directory first
-            session_dir = os.path.join(base_search_dir, f"session_{session_id}")
-            if os.path.exists(session_dir):
-                search_patterns.append(os.path.join(session_dir, f"query_{query_id}_*.mp3"))
-        
-        # Also search in general user directory
-        search_patterns.append(os.path.join(base_search_dir, f"query_{query_id}_*.mp3"))
-        
-        # Search for all possible subdirectories
-        search_patterns.append(os.path.join(base_search_dir, "**", f"query_{query_id}_*.mp3"))
-        
-        found_files = []
-        
-        for pattern in search_patterns:
-            matches = glob.glob(pattern, recursive=True)
-            found_files.extend(matches)
-        
-        if not found_files:
+
+        # Written when the clip was generated; query ids are unique, so session_id isn't needed to find it
+        found = await asyncio.to_thread(indexed_clip, user_id, query_id)
+        if found is None:
             raise HTTPException(status_code=404, detail=f"Audio file not found for query_id: {query_id}")
-        
-        # Get the most recent file if multiple matches
-        audio_file = max(found_files, key=lambda f: os.path.getmtime(f))
-        
-        # Create a temporary static file for serving
-        static_filename = f"retrieved_{int(time.time())}_{os.path.basename(audio_file)}"
-        static_path = os.path.join(STATIC_DIR, static_filename)
-        
-        # Copy to static directory for serving
-        shutil.copy(audio_file, static_path)
-        
-        audio_url = f"/api/static/{static_filename}"
-        
-        logger.info(f"Found audio file: {audio_file}")
-        logger.info(f"Serving via: {audio_url}")
-        
+        clip, file_size = found
+
+        logger.info(f"Serving via: {clip['audio_url']}")
+
         return {
             "success": True,
-            "audio_url": audio_url,
+            "audio_url": clip["audio_url"],
+            "timings": clip["timings"],
             "query_id": query_id,
-            "session_id": session_id,
-            "file_path": audio_file,
+            "session_id": clip["session_id"],
+            "file_path": clip["file_path"],
             "metadata": {
-                "file_size": os.path.getsize(audio_file),
-                "created_time": os.path.getmtime(audio_file)
+                "file_size": file_size,
+                "created_time": clip["created_at"]
             }
         }
         
@@ -0,0 +1,80 @@
+# singleflight.py
+
+import asyncio
+import hashlib
+import inspect
+import logging
+
+import metrics
+
+logger = logging.getLogger("singleflight")
+
+def prompt_key(kind: str, prompt: str) -> str:
+    """Stable key for an LLM call: the helper being called plus a hash of the exact prompt"""
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{kind}:{digest}"
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one upstream call.
+
+    The first caller for a key starts the call as a separate task; every caller
+    that arrives while it is in flight awaits the same task and receives the same
+    result or the same exception. The task is shielded, so a client disconnect on
+    one request does not cancel the generation the others are waiting on.
+    Sync callables are run in a worker thread so they don't block the event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+
+    def inflight_count(self) -> int:
+        return len(self._inflight)
+
+    def join(self, key: str):
+        """Awaitable result of the call in flight for `key`, or None if there is none"""
+        task = self._inflight.get(key)
+        if task is None:
+            return None
+        metrics.inc(f"{self.name}.coalesced")  # upstream calls saved
+        logger.info(f"[{self.name}] Joining in-flight call for {key[:24]}...")
+        return asyncio.shield(task)
+
+    def lead(self, key: str) -> asyncio.Future:
+        """
+        Register the caller as the call in flight for `key`, for work that isn't one
+        coroutine (e.g. a generator streaming partial results). do() and join() wait on
+        the returned future; the caller must always set its result or exception.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        metrics.inc(f"{self.name}.upstream_calls")
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    async def do(self, key: str, fn, *args, **kwargs):
+        joined = self.join(key)
+        if joined is not None:
+            return await joined
+
+        if inspect.iscoroutinefunction(fn):
+            coro = fn(*args, **kwargs)
+        else:
+            coro = asyncio.to_thread(fn, *args, **kwargs)
+
+        task = asyncio.ensure_future(coro)
+        self._inflight[key] = task
+        metrics.inc(f"{self.name}.upstream_calls")
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled() and task.exception() is not None:
+            metrics.inc(f"{self.name}.errors")
+
+# Shared coalescer for all LLM generations made by the API routers
+llm_singleflight = SingleFlight("llm")
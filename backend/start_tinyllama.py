@@ -2,13 +2,24 @@
 """
 TinyLlama Model Server Startup Script
 Run this script to start the TinyLlama model service on port 8001
+
+    python start_tinyllama.py                              # development, auto-reload
+    python start_tinyllama.py --production --workers 4     # model loaded once, forked workers
 """
 
+import argparse
+import gc
+import select
+import signal
+import socket
 import subprocess
 import sys
 import os
+import threading
 import time
 
+PORT = 8001
+
 def check_dependencies():
     """Check if required dependencies are installed"""
     try:
@@ -25,7 +36,7 @@ def check_dependencies():
         print("pip install uvicorn fastapi transformers peft torch")
         return False
 
-def start_tinyllama_server():
+def start_tinyllama_server(model_path=None, quantize=None):
     """Start the TinyLlama model server"""
     model_dir = os.path.join(os.path.dirname(__file__), "model")
     app_file = os.path.join(model_dir, "LLM_app.py")
@@ -38,6 +49,14 @@ def start_tinyllama_server():
     print(f"📁 Model directory: {model_dir}")
     print("🌐 Server will be available at: http://localhost:8001")
     print("📋 API documentation: http://localhost:8001/docs")
+
+    env = os.environ.copy()
+    if model_path:
+        # Merged artifact from model/build_merged_model.py
+        env["TINYLLAMA_MODEL_PATH"] = os.path.abspath(model_path)
+        print(f"🧩 Merged model: {env['TINYLLAMA_MODEL_PATH']}")
+    if quantize:
+        env["TINYLLAMA_QUANTIZE"] = quantize
     print("\n" + "="*50)
     
     try:
@@ -48,7 +67,7 @@ def start_tinyllama_server():
             "--host", "0.0.0.0", 
             "--port", "8001",
             "--reload"
-        ], cwd=model_dir, check=True)
+        ], cwd=model_dir, env=env, check=True)
     except subprocess.CalledProcessError as e:
         print(f"✗ Failed to start server: {e}")
         return False
@@ -56,14 +75,120 @@ def start_tinyllama_server():
         print("\n🛑 Server stopped by user")
         return True
 
+def serve_production(workers, threads, model_path=None, quantize=None):
+    """
+    Load the model once in this process, then fork workers that share its
+    weights copy-on-write and accept on one pre-bound socket. Workers are
+    restarted if they die; the service is reported ready once every worker
+    has finished its warmup generation.
+    """
+    model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+    if model_path:
+        os.environ["TINYLLAMA_MODEL_PATH"] = os.path.abspath(model_path)
+    if quantize:
+        os.environ["TINYLLAMA_QUANTIZE"] = quantize
+    # The tokenizer's Rust thread pool doesn't survive fork
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    # LLM_app uses paths relative to the model directory
+    os.chdir(model_dir)
+    sys.path.insert(0, model_dir)
+
+    import torch
+    import uvicorn
+
+    print(f"📦 Loading TinyLlama once (pid {os.getpid()})...")
+    start = time.perf_counter()
+    import LLM_app
+    print(f"✓ Model loaded in {time.perf_counter() - start:.1f}s")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    ready_r, ready_w = os.pipe()
+    # Objects allocated so far are never collected, so the GC won't dirty their pages in the workers
+    gc.freeze()
+
+    def spawn():
+        pid = os.fork()
+        if pid:
+            return pid
+        os.close(ready_r)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        torch.set_num_threads(threads)
+
+        def report_ready():
+            LLM_app.warmup_done.wait()
+            os.write(ready_w, b"1")
+
+        threading.Thread(target=report_ready, daemon=True).start()
+        server = uvicorn.Server(uvicorn.Config(LLM_app.app, log_level="info"))
+        server.run(sockets=[sock])
+        os._exit(0)
+
+    print(f"🚀 Starting {workers} workers x {threads} torch threads on http://localhost:{PORT}")
+    children = {spawn() for _ in range(workers)}
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    ready = 0
+    while children:
+        readable, _, _ = select.select([ready_r], [], [], 1.0)
+        if readable:
+            ready += len(os.read(ready_r, 64))
+            print(f"✓ Worker warm ({min(ready, workers)}/{workers})")
+            if ready == workers:
+                print("✅ TinyLlama service ready")
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            children.discard(pid)
+            if not stopping:
+                print(f"✗ Worker {pid} exited ({status}); restarting")
+                children.add(spawn())
+
+    print("\n🛑 Server stopped")
+    return True
+
 def main():
+    parser = argparse.ArgumentParser(description="Start the TinyLlama model server")
+    parser.add_argument("--model-path", help="load a merged model built by model/build_merged_model.py")
+    parser.add_argument("--quantize", choices=["none", "int8"], help="override the artifact's quantization")
+    parser.add_argument("--production", action="store_true", help="load the model once and fork worker processes (no reload)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("TINYLLAMA_WORKERS", "2")))
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker (default: cores / workers)")
+    args = parser.parse_args()
+
     print("TinyLlama Model Server Startup")
     print("=" * 40)
     
     if not check_dependencies():
         sys.exit(1)
     
-    success = start_tinyllama_server()
+    if args.production:
+        threads = args.threads or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+        success = serve_production(max(1, args.workers), threads, args.model_path, args.quantize)
+    else:
+        success = start_tinyllama_server(args.model_path, args.quantize)
     if not success:
         sys.exit(1)
 
@@ -106,6 +106,28 @@ def upload_audio_to_supabase(file_path: str, target_path: str, bucket: str = DEF
         raise e
 
 
+def publish_audio(audio_path: str, target_path: str) -> str:
+    """
+    Make a stored clip available at generated_audio/<target_path> and return its
+    /api/audio URL. The file is hardlinked rather than copied, so the audio bytes
+    stay on disk once however many users and queries share them.
+    """
+    organized_file_path = os.path.join(AUDIO_STORAGE_DIR, *target_path.split('/'))
+    os.makedirs(os.path.dirname(organized_file_path), exist_ok=True)
+    try:
+        os.link(audio_path, organized_file_path)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        # Different filesystem or no hardlink support: fall back to one copy
+        logger.warning(f"Hardlink failed ({e}), copying audio instead")
+        shutil.copy(audio_path, organized_file_path)
+
+    public_url = f"/api/audio/{target_path}"
+    logger.info(f"Audio file accessible at: {public_url}")
+    return public_url
+
+
 def upload_pdf_or_image(file_path: str, file_type: str = "pdf") -> str:
     """
     Uploads a PDF or image to the user-uploads bucket.
@@ -1,19 +1,106 @@
 # tinyllama_client.py
 
+import asyncio
+import os
 import requests
+import httpx
 import json
+import time
 from typing import Optional
 
+import metrics
+
 # Assuming the TinyLlama model is running on a separate port
-TINYLLAMA_BASE_URL = "http://localhost:8001"  # Adjust port as needed
+TINYLLAMA_BASE_URL = os.getenv("TINYLLAMA_BASE_URL", "http://localhost:8001").rstrip("/")
+
+TINYLLAMA_TIMEOUT = float(os.getenv("TINYLLAMA_TIMEOUT", "30"))
+TINYLLAMA_MAX_CONNECTIONS = int(os.getenv("TINYLLAMA_MAX_CONNECTIONS", "16"))
+# Background readiness probe: interval and per-probe timeout (seconds)
+TINYLLAMA_HEALTH_INTERVAL = float(os.getenv("TINYLLAMA_HEALTH_INTERVAL", "5"))
+TINYLLAMA_HEALTH_TIMEOUT = float(os.getenv("TINYLLAMA_HEALTH_TIMEOUT", "1"))
+
+_client = None
+_prober = None
+_health = {"ready": None, "checked_at": None, "error": None}
+
+def get_client() -> httpx.AsyncClient:
+    """Shared keep-alive connection pool to the local model server"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=TINYLLAMA_BASE_URL,
+            timeout=httpx.Timeout(TINYLLAMA_TIMEOUT, connect=1.0),
+            limits=httpx.Limits(
+                max_connections=TINYLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=TINYLLAMA_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            )
+        )
+    return _client
+
+async def close_client():
+    global _client, _prober
+    if _prober is not None:
+        _prober.cancel()
+        _prober = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _set_health(ready: bool, error: str = None):
+    if not ready:
+        metrics.inc("tinyllama.health.unready")
+    _health.update(ready=ready, checked_at=time.monotonic(), error=error)
+
+async def probe_health() -> bool:
+    """Ask the model server whether it is warm (/ready) and cache the answer"""
+    try:
+        response = await get_client().get("/ready", timeout=TINYLLAMA_HEALTH_TIMEOUT)
+        ready = response.status_code == 200
+        _set_health(ready, None if ready else f"/ready returned {response.status_code}")
+    except httpx.HTTPError as e:
+        _set_health(False, str(e) or type(e).__name__)
+    return _health["ready"]
+
+async def _probe_loop():
+    while True:
+        await probe_health()
+        await asyncio.sleep(TINYLLAMA_HEALTH_INTERVAL)
 
-def get_sentiment_adaptive_prompt(query: str, sentiment: str, level: str = "college", affiliation: str = "student") -> str:
+def start_health_prober():
+    """Start probing in the background; call from the event loop (app startup)"""
+    global _prober
+    if _prober is None or _prober.done():
+        _prober = asyncio.get_running_loop().create_task(_probe_loop())
+
+def is_ready() -> bool:
+    """Cached readiness, no I/O. Optimistic until the first probe has answered."""
+    return _health["ready"] is not False
+
+def health_state() -> dict:
+    checked_at = _health["checked_at"]
+    return {
+        "ready": _health["ready"],
+        "error": _health["error"],
+        "age": round(time.monotonic() - checked_at, 1) if checked_at is not None else None
+    }
+
+def _call_timeout(timeout: float = None, deadline=None) -> float:
+    # Per-call timeout, further bounded by the caller's request deadline if one is given
+    limit = timeout or TINYLLAMA_TIMEOUT
+    if deadline is not None:
+        limit = min(limit, deadline.remaining())
+    return limit
+
+def get_sentiment_adaptive_prompt(query: str, sentiment: str, level: str = "college", affiliation: str = "student", context: str = "", instructions: str = "") -> str:
     """
-    Create a sentiment-adaptive prompt for TinyLlama based on the user's emotional state
+    Create a sentiment-adaptive prompt for TinyLlama based on the user's emotional state.
+    `context` (earlier questions in the session) and `instructions` (answer style) carry
+    over what the Groq prompt for the same request contains.
     """
     base_intro = f"You are a compassionate and emotionally intelligent STEM tutor for a {level} {affiliation}."
     
-    if sentiment.upper() == "NEGATIVE":
+    if (sentiment or "").upper() == "NEGATIVE":
         sentiment_guidance = """
         The student is feeling negative or frustrated. Your response should:
         - Be encouraging and supportive
@@ -23,7 +110,7 @@ def get_sentiment_adaptive_prompt(query: str, sentiment: str, level: str = "coll
         - Provide confidence-building explanations
         - Include phrases like "Don't worry, this is common" or "Let's break this down together"
         """
-    elif sentiment.upper() == "POSITIVE":
+    elif (sentiment or "").upper() == "POSITIVE":
         sentiment_guidance = """
         The student is feeling positive and engaged. Your response should:
         - Match their enthusiasm and energy
@@ -43,7 +130,13 @@ def get_sentiment_adaptive_prompt(query: str, sentiment: str, level: str = "coll
         - Maintain engagement without being overly enthusiastic
         """
     
-    return f"{base_intro}\n\n{sentiment_guidance}\n\nNow answer this question: {query}"
+    prompt = f"{base_intro}\n\n{sentiment_guidance}"
+    if context:
+        prompt += f"\n\nEarlier in this session the student asked:\n{context}"
+    prompt += f"\n\nNow answer this question: {query}"
+    if instructions:
+        prompt += f"\n{instructions}"
+    return prompt
 
 def get_tinyllama_response(query: str, sentiment: str, level: str = "college", affiliation: str = "student", mode: str = "default") -> Optional[str]:
     """
@@ -82,6 +175,106 @@ def get_tinyllama_response(query: str, sentiment: str, level: str = "college", a
         print(f"Unexpected error in TinyLlama client: {e}")
         return None
 
+async def get_tinyllama_response_async(query: str, sentiment: str, level: str = "college", affiliation: str = "student", mode: str = "default", timeout: float = None, deadline=None, context: str = "", instructions: str = "") -> Optional[str]:
+    """
+    Async variant of get_tinyllama_response for use inside request handlers (e.g. as the hedge backend).
+    Returns None straight away if the prober has marked the server unready.
+    """
+    limit = _call_timeout(timeout, deadline)
+    if not is_ready() or limit <= 0:
+        metrics.inc("tinyllama.skipped")
+        return None
+    try:
+        request_data = {
+            "query": get_sentiment_adaptive_prompt(query, sentiment, level, affiliation, context, instructions),
+            "level": level,
+            "affiliation": affiliation,
+            "mode": mode
+        }
+        response = await get_client().post("/explain", json=request_data, timeout=limit)
+
+        if response.status_code == 200:
+            return response.json().get("answer", "")
+        print(f"TinyLlama API error: {response.status_code}")
+        return None
+
+    except httpx.TimeoutException:
+        print(f"TinyLlama API timed out after {limit:.1f}s")
+        return None
+    except httpx.HTTPError as e:
+        # Connection-level failure: stop sending traffic until the next probe succeeds
+        _set_health(False, str(e) or type(e).__name__)
+        print(f"Error calling TinyLlama API: {e}")
+        return None
+
+async def stream_tinyllama_response(query: str, sentiment: str, level: str = "college", affiliation: str = "student", mode: str = "default", timeout: float = None, deadline=None):
+    """
+    Stream an answer from TinyLlama's /explain/stream endpoint (server-sent events).
+    Yields decoded text chunks as the model produces them.
+    """
+    limit = _call_timeout(timeout, deadline)
+    if not is_ready() or limit <= 0:
+        metrics.inc("tinyllama.skipped")
+        return
+    request_data = {
+        "query": get_sentiment_adaptive_prompt(query, sentiment, level, affiliation),
+        "level": level,
+        "affiliation": affiliation,
+        "mode": mode
+    }
+    try:
+        # Each read is bounded by the call timeout, and so is the stream as a whole
+        ends_at = time.monotonic() + limit
+        async with get_client().stream("POST", "/explain/stream", json=request_data, timeout=limit) as response:
+            if response.status_code != 200:
+                print(f"TinyLlama stream error: {response.status_code}")
+                return
+            event = None
+            async for line in response.aiter_lines():
+                if time.monotonic() > ends_at:
+                    print(f"TinyLlama stream timed out after {limit:.1f}s")
+                    return
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    try:
+                        data = json.loads(line[len("data:"):].strip())
+                    except ValueError:
+                        # Malformed or partial event: skip it rather than end the answer
+                        print(f"TinyLlama stream: skipping malformed event data: {line[:80]!r}")
+                        continue
+                    if not isinstance(data, dict):
+                        continue
+                    if event is None and data.get("token"):
+                        yield data["token"]
+                    elif event == "error":
+                        print(f"TinyLlama stream error: {data.get('error')}")
+                        return
+                    elif event == "done":
+                        return
+                elif not line:
+                    event = None
+    except httpx.HTTPError as e:
+        print(f"Error streaming from TinyLlama API: {e}")
+
+async def stream_tinyllama_batch(items: list, timeout: float = None):
+    """
+    Run many /explain requests through TinyLlama's /explain/batch endpoint.
+    `items` are QueryRequest-shaped dicts (optionally with an "id"); yields one
+    result dict per item as it finishes, in completion order. `timeout` bounds
+    the wait for each next result, not the whole batch.
+    """
+    try:
+        async with get_client().stream("POST", "/explain/batch", json={"requests": items}, timeout=timeout or TINYLLAMA_TIMEOUT) as response:
+            if response.status_code != 200:
+                print(f"TinyLlama batch error: {response.status_code}")
+                return
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+    except httpx.HTTPError as e:
+        print(f"Error streaming batch from TinyLlama API: {e}")
+
 def get_tinyllama_sentiment_adaptive_response(query: str, sentiment: str, sentiment_score: float, context: str = "") -> Optional[str]:
     """
     Get a sentiment-adaptive response from TinyLlama with additional context
@@ -127,10 +320,14 @@ def get_tinyllama_sentiment_adaptive_response(query: str, sentiment: str, sentim
 
 def check_tinyllama_health() -> bool:
     """
-    Check if TinyLlama service is running and healthy
+    Check if TinyLlama service is running and healthy.
+    Uses the background prober's answer when it is recent, otherwise asks /ready.
     """
+    checked_at = _health["checked_at"]
+    if checked_at is not None and time.monotonic() - checked_at < 2 * TINYLLAMA_HEALTH_INTERVAL:
+        return bool(_health["ready"])
     try:
-        response = requests.get(f"{TINYLLAMA_BASE_URL}/", timeout=5)
+        response = requests.get(f"{TINYLLAMA_BASE_URL}/ready", timeout=TINYLLAMA_HEALTH_TIMEOUT)
         return response.status_code == 200
     except:
         return False
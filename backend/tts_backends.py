@@ -0,0 +1,229 @@
+# tts_backends.py
+
+import asyncio
+import io
+import json
+import logging
+import os
+import tempfile
+import wave
+
+import google_tts
+from audio_duration import align_timings
+from google_tts import estimate_timings
+
+logger = logging.getLogger("tts_backends")
+
+# Backend used when a request doesn't name one: "google" or "local"
+TTS_BACKEND = os.getenv("TTS_BACKEND", "google")
+
+# Local engine: "espeak-ng" (any espeak-ng install) or "piper" (needs a voice model)
+LOCAL_TTS_ENGINE = os.getenv("LOCAL_TTS_ENGINE", "espeak-ng")
+LOCAL_TTS_BINARY = os.getenv("LOCAL_TTS_BINARY", LOCAL_TTS_ENGINE)
+# espeak-ng voice; derived from the request's language code when unset
+LOCAL_TTS_VOICE = os.getenv("LOCAL_TTS_VOICE")
+LOCAL_TTS_WORDS_PER_MINUTE = int(os.getenv("LOCAL_TTS_WORDS_PER_MINUTE", "160"))
+# Path to a piper .onnx voice (its .onnx.json config sits next to it)
+LOCAL_TTS_PIPER_MODEL = os.getenv("LOCAL_TTS_PIPER_MODEL")
+# Synthesis processes running at once; each one keeps a CPU core busy
+LOCAL_TTS_MAX_CONCURRENCY = int(os.getenv("LOCAL_TTS_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+
+# Output encodings: file extension and the content type it is served with
+AUDIO_FORMATS = {
+    "MP3": {"extension": ".mp3", "content_type": "audio/mpeg"},
+    "OGG_OPUS": {"extension": ".ogg", "content_type": "audio/ogg"},
+    "LINEAR16": {"extension": ".wav", "content_type": "audio/wav"},
+}
+
+# Output profiles a request can ask for: encoding plus sample rate (None = the voice's own).
+# Speech needs little bandwidth; opus is the smallest, linear16 is uncompressed (tests)
+AUDIO_PROFILES = {
+    "mp3": {"encoding": "MP3", "sample_rate_hertz": None},
+    "mp3_low": {"encoding": "MP3", "sample_rate_hertz": 16000},
+    "opus": {"encoding": "OGG_OPUS", "sample_rate_hertz": 24000},
+    "linear16": {"encoding": "LINEAR16", "sample_rate_hertz": 16000},
+}
+# Profile used when a request doesn't name one (if its backend supports it)
+TTS_AUDIO_PROFILE = os.getenv("TTS_AUDIO_PROFILE", "mp3")
+
+def profile_encoding(profile: str) -> str:
+    return AUDIO_PROFILES[profile]["encoding"]
+
+def profile_extension(profile: str) -> str:
+    return AUDIO_FORMATS[profile_encoding(profile)]["extension"]
+
+def profile_content_type(profile: str) -> str:
+    return AUDIO_FORMATS[profile_encoding(profile)]["content_type"]
+
+def join_audio(parts, encoding: str) -> bytes:
+    """
+    One clip from consecutive chunks: MP3 frames concatenate as-is, and so do Ogg
+    streams (the result is a chained Ogg file); WAV needs a single header.
+    """
+    if encoding != "LINEAR16":
+        return b"".join(parts)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as writer:
+        for index, part in enumerate(parts):
+            with wave.open(io.BytesIO(part), "rb") as reader:
+                if index == 0:
+                    writer.setparams(reader.getparams())
+                writer.writeframes(reader.readframes(reader.getnframes()))
+    return out.getvalue()
+
+def pcm_to_wav(pcm: bytes, sample_rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(sample_width)
+        writer.setframerate(sample_rate)
+        writer.writeframes(pcm)
+    return out.getvalue()
+
+class TTSBackend:
+    """
+    A speech engine. synthesize() returns (audio_bytes, timings) for one chunk of
+    text in one of the backend's `profiles`; long text is split and the results
+    joined by tts_chunking.
+    """
+
+    name = None
+    profiles = tuple(AUDIO_PROFILES)
+
+    def profile(self, name: str = None) -> str:
+        """Profile to synthesize in: `name`, else TTS_AUDIO_PROFILE, else the backend's first"""
+        if name is None:
+            return TTS_AUDIO_PROFILE if TTS_AUDIO_PROFILE in self.profiles else self.profiles[0]
+        if name not in self.profiles:
+            raise ValueError(f"TTS backend '{self.name}' doesn't support profile '{name}' (available: {', '.join(self.profiles)})")
+        return name
+
+    async def synthesize(self, text: str, language_code: str, voice_name: str, profile: str):
+        raise NotImplementedError
+
+    def join(self, parts, profile: str) -> bytes:
+        return join_audio(parts, profile_encoding(profile))
+
+    async def close(self):
+        pass
+
+class GoogleTTSBackend(TTSBackend):
+    """Google Cloud TTS through the async client (quota, timeout and retries live in google_tts)"""
+
+    name = "google"
+
+    async def synthesize(self, text: str, language_code: str, voice_name: str, profile: str):
+        return await google_tts.synthesize_audio_async(
+            text,
+            language_code=language_code,
+            voice_name=voice_name,
+            encoding=AUDIO_PROFILES[profile]["encoding"],
+            sample_rate_hertz=AUDIO_PROFILES[profile]["sample_rate_hertz"]
+        )
+
+    async def close(self):
+        await google_tts.close_async_client()
+
+class LocalTTSBackend(TTSBackend):
+    """
+    Offline CPU synthesis with espeak-ng or piper, run as a subprocess per chunk.
+    Returns WAV; there's no network or per-character cost, so it also serves
+    load tests of the voice path. Google voice names don't apply and are ignored.
+    """
+
+    name = "local"
+    profiles = ("linear16",)
+
+    def __init__(self, engine: str = LOCAL_TTS_ENGINE, binary: str = LOCAL_TTS_BINARY):
+        if engine not in ("espeak-ng", "piper"):
+            raise ValueError(f"Unknown local TTS engine: {engine}")
+        self.engine = engine
+        self.binary = binary
+        self._slots = None
+        self._piper_sample_rate = None
+
+    def _espeak_voice(self, language_code: str) -> str:
+        # espeak-ng knows "en-us" but not "hi-in"; the bare language works for both
+        return LOCAL_TTS_VOICE or language_code.split("-")[0].lower()
+
+    def _piper_rate(self) -> int:
+        if self._piper_sample_rate is None:
+            with open(LOCAL_TTS_PIPER_MODEL + ".json") as f:
+                self._piper_sample_rate = json.load(f)["audio"]["sample_rate"]
+        return self._piper_sample_rate
+
+    def _command(self, language_code: str):
+        if self.engine == "piper":
+            if not LOCAL_TTS_PIPER_MODEL:
+                raise RuntimeError("LOCAL_TTS_PIPER_MODEL is not set")
+            return [self.binary, "--model", LOCAL_TTS_PIPER_MODEL, "--output-raw"]
+        return [self.binary, "-v", self._espeak_voice(language_code), "-s", str(LOCAL_TTS_WORDS_PER_MINUTE), "--stdout"]
+
+    async def synthesize(self, text: str, language_code: str, voice_name: str, profile: str):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(LOCAL_TTS_MAX_CONCURRENCY)
+        async with self._slots:
+            process = await asyncio.create_subprocess_exec(
+                *self._command(language_code),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                audio, errors = await process.communicate(text.encode("utf-8"))
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+        if process.returncode != 0 or not audio:
+            raise RuntimeError(f"{self.engine} failed ({process.returncode}): {errors.decode(errors='replace').strip()}")
+        if self.engine == "piper":
+            # piper writes raw 16-bit mono PCM at the voice's sample rate
+            audio = pcm_to_wav(audio, self._piper_rate())
+        return audio, align_timings(estimate_timings(text), audio, "LINEAR16")
+
+    async def close(self):
+        # The semaphore belongs to the loop it was first used on
+        self._slots = None
+
+BACKENDS = {
+    "google": GoogleTTSBackend(),
+    "local": LocalTTSBackend(),
+}
+
+def get_backend(name: str = None) -> TTSBackend:
+    """Backend by name (TTS_BACKEND when None); ValueError for unknown names"""
+    name = name or TTS_BACKEND
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown TTS backend '{name}' (available: {', '.join(BACKENDS)})")
+
+def resolve_voice_output(backend: str = None, profile: str = None):
+    """(backend, profile name) for a request; ValueError for unknown or unsupported choices"""
+    selected = get_backend(backend)
+    return selected, selected.profile(profile)
+
+async def close_backends():
+    for backend in BACKENDS.values():
+        await backend.close()
+
+def synthesize_with_timings(text: str, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D", backend: str = None, profile: str = None):
+    """
+    google_tts.synthesize_with_timings for any backend and profile, for scripts and
+    load tests: writes the clip to a temp file with the profile's extension and
+    returns (temp file path, timings). Not for use inside the event loop.
+    """
+    from tts_chunking import synthesize_chunked
+
+    selected, profile = resolve_voice_output(backend, profile)
+
+    async def run():
+        try:
+            return await synthesize_chunked(text, language_code, voice_name, backend=selected.name, profile=profile)
+        finally:
+            await selected.close()
+
+    audio, timings = asyncio.run(run())
+    with tempfile.NamedTemporaryFile(suffix=profile_extension(profile), delete=False) as tmp:
+        tmp.write(audio)
+    return tmp.name, timings
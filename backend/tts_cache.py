@@ -0,0 +1,193 @@
+# tts_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from audio_index import audio_index
+from supabase_client import AUDIO_STORAGE_DIR
+
+logger = logging.getLogger("tts_cache")
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(AUDIO_STORAGE_DIR, "tts_cache"))
+# Disk quota for cached audio; least recently used clips are evicted beyond it
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+def normalize_tts_text(text: str) -> str:
+    # Whitespace differences don't change the narration
+    return " ".join(text.split())
+
+def tts_cache_key(text: str, language_code: str, voice_name: str, profile: str = "mp3", backend: str = "google") -> str:
+    blob = json.dumps([normalize_tts_text(text), language_code, voice_name, profile, backend])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class AudioCache:
+    """
+    Content-addressed store of synthesized clips: <dir>/<key[:2]>/<key>.<ext> (.mp3,
+    .ogg, .wav by output profile) plus a <key>.json sidecar with the timings. This is the only place audio is written;
+    per-user paths are hardlinks to these files, listed in a <key>.links file so
+    that evicting a clip removes them too and actually frees its bytes. The index
+    of sizes and last-use times is rebuilt from disk at startup; hits bump the file
+    mtime so LRU order survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # key -> [size, last use, extension]
+        self._index = {}
+        self._total = 0
+        # key -> number of requests between reading the clip and publishing it
+        self._pins = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                key, extension = os.path.splitext(name)
+                if extension in (".json", ".links", ".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                self._index[key] = [stat.st_size, stat.st_mtime, extension]
+                self._total += stat.st_size
+        logger.info(f"TTS cache: {len(self._index)} clips, {self._total / 1e6:.1f} MB in {self.directory}")
+
+    def audio_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def _sidecar_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def key_for_path(self, path: str) -> str:
+        """Key of a clip stored in this cache, from its path; ValueError for paths outside it"""
+        key = os.path.splitext(os.path.basename(path))[0]
+        if os.path.abspath(path) != os.path.abspath(self.audio_path(key, os.path.splitext(path)[1])):
+            raise ValueError(f"Not a TTS cache path: {path}")
+        return key
+
+    def _links_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".links")
+
+    def _links(self, key: str):
+        try:
+            with open(self._links_path(key)) as f:
+                return [line for line in f.read().splitlines() if line]
+        except FileNotFoundError:
+            return []
+
+    def track_link(self, key: str, link_path: str):
+        """
+        Remember a published hardlink (or copy) of the clip, so eviction removes it.
+        Call before creating the link: a listed path that doesn't exist is harmless,
+        an untracked link would hold the bytes forever.
+        """
+        link_path = os.path.abspath(link_path)
+        with self._lock:
+            if link_path in self._links(key):
+                return
+            with open(self._links_path(key), "a") as f:
+                f.write(link_path + "\n")
+
+    @contextmanager
+    def pinned(self, key: str):
+        """
+        Keep the clip from being evicted inside the block, so a path returned by get()
+        or put() is still there to publish. The key need not be cached yet.
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def get(self, key: str):
+        """(audio_path, timings) for a cached clip, or None"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                entry[1] = time.time()
+        if entry is None:
+            metrics.inc("tts_cache.misses")
+            return None
+        path = self.audio_path(key, entry[2])
+        try:
+            with open(self._sidecar_path(key)) as f:
+                timings = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Evicted or damaged underneath us
+            self._remove(key)
+            metrics.inc("tts_cache.misses")
+            return None
+        metrics.inc("tts_cache.hits")
+        return path, timings
+
+    def put(self, key: str, audio: bytes, timings, extension: str = ".mp3") -> str:
+        """Write synthesized audio straight from memory into the cache; returns its path"""
+        path = self.audio_path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sidecar = self._sidecar_path(key)
+        # Write under a per-writer temporary name and rename, so readers never see a partial clip
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(sidecar + suffix, "w") as f:
+            json.dump(timings, f)
+        os.replace(sidecar + suffix, sidecar)
+        with open(path + suffix, "wb") as f:
+            f.write(audio)
+        os.replace(path + suffix, path)
+        size = len(audio)
+        with self._lock:
+            previous = self._index.get(key)
+            if previous is not None:
+                self._total -= previous[0]
+            self._index[key] = [size, time.time(), extension]
+            self._total += size
+        metrics.inc("tts_cache.stores")
+        self._evict()
+        return path
+
+    def _remove(self, key: str):
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry is not None:
+                self._total -= entry[0]
+            links = self._links(key)
+        paths = links + [self._links_path(key), self._sidecar_path(key)]
+        if entry is not None:
+            paths.append(self.audio_path(key, entry[2]))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        # /voice/audio must not point at the removed copies (or the unpublished cached file)
+        audio_index.forget_files(paths)
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._total <= self.max_bytes or len(self._index) <= 1:
+                    return
+                unpinned = [k for k in self._index if k not in self._pins]
+                if not unpinned:
+                    return
+                key = min(unpinned, key=lambda k: self._index[k][1])
+            self._remove(key)
+            metrics.inc("tts_cache.evictions")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clips": len(self._index), "bytes": self._total, "max_bytes": self.max_bytes}
+
+tts_cache = AudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
@@ -0,0 +1,128 @@
+# tts_chunking.py
+
+import asyncio
+import logging
+import os
+import re
+
+from tts_backends import resolve_voice_output
+
+logger = logging.getLogger("tts_chunking")
+
+# Google TTS rejects inputs over 5000 bytes; keep some headroom
+TTS_MAX_CHUNK_BYTES = int(os.getenv("TTS_MAX_CHUNK_BYTES", "4800"))
+# Chunks synthesized at the same time for one request
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "4"))
+# Streaming: keep the first chunk short so playback can start quickly
+TTS_FIRST_CHUNK_BYTES = int(os.getenv("TTS_FIRST_CHUNK_BYTES", "300"))
+
+# Sentence ends (.!? followed by whitespace) and line breaks
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\s*\n+\s*")
+
+def _split_oversized(piece: str, max_bytes: int):
+    # A single sentence over the limit: break between words, or inside a word as a last resort
+    words = []
+    for word in piece.split():
+        encoded = len(word.encode("utf-8"))
+        if encoded <= max_bytes:
+            words.append((word, encoded))
+            continue
+        part, part_bytes = [], 0
+        for char in word:
+            char_bytes = len(char.encode("utf-8"))
+            if part_bytes + char_bytes > max_bytes:
+                words.append(("".join(part), part_bytes))
+                part, part_bytes = [], 0
+            part.append(char)
+            part_bytes += char_bytes
+        if part:
+            words.append(("".join(part), part_bytes))
+    return words
+
+def split_text_for_tts(text: str, max_bytes: int = TTS_MAX_CHUNK_BYTES, first_chunk_bytes: int = None):
+    """
+    Split text into chunks of at most `max_bytes` UTF-8 bytes, breaking between
+    sentences where possible. Each sentence is encoded once. With
+    `first_chunk_bytes` the first chunk is packed to that smaller size instead
+    (it still holds at least one whole sentence).
+    """
+    chunks = []
+    current, current_bytes = [], 0
+
+    def add(piece, piece_bytes):
+        nonlocal current, current_bytes
+        limit = first_chunk_bytes if first_chunk_bytes and not chunks else max_bytes
+        joined = current_bytes + piece_bytes + (1 if current else 0)
+        if current and joined > limit:
+            chunks.append(" ".join(current))
+            current, current_bytes = [piece], piece_bytes
+        else:
+            current.append(piece)
+            current_bytes = joined
+
+    for sentence in _SENTENCE_BREAK.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        sentence_bytes = len(sentence.encode("utf-8"))
+        if sentence_bytes <= max_bytes:
+            add(sentence, sentence_bytes)
+        else:
+            for word, word_bytes in _split_oversized(sentence, max_bytes):
+                add(word, word_bytes)
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def shift_timings(timings, offset: float):
+    return [{**timing, "start": timing["start"] + offset, "end": timing["end"] + offset} for timing in timings]
+
+def clip_duration(timings) -> float:
+    return timings[-1]["end"] if timings else 0.0
+
+async def synthesize_chunked(text: str, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D", max_bytes: int = TTS_MAX_CHUNK_BYTES, backend: str = None, profile: str = None):
+    """
+    (audio_bytes, timings) for text of any length: chunks are synthesized
+    concurrently on the selected backend and output profile, then their audio
+    and timings are joined in order (see tts_backends.join_audio). Nothing touches the disk.
+    """
+    engine, profile = resolve_voice_output(backend, profile)
+    chunks = split_text_for_tts(text, max_bytes)
+    if len(chunks) <= 1:
+        return await engine.synthesize(chunks[0] if chunks else text, language_code, voice_name, profile)
+
+    logger.info(f"Synthesizing {len(chunks)} chunks on {engine.name} with up to {TTS_MAX_PARALLEL} in parallel")
+    parts = []
+    timings = []
+    offset = 0.0
+    async for _, chunk_audio, chunk_timings in synthesize_chunks_in_order(chunks, language_code, voice_name, backend, profile):
+        parts.append(chunk_audio)
+        timings += shift_timings(chunk_timings, offset)
+        offset += clip_duration(chunk_timings)
+    return engine.join(parts, profile), timings
+
+async def synthesize_chunks_in_order(chunks, language_code: str = "en-US", voice_name: str = "en-US-Wavenet-D", backend: str = None, profile: str = None):
+    """
+    Async generator of (index, audio_bytes, timings) per chunk, in order. All chunks
+    start synthesizing right away (at most TTS_MAX_PARALLEL at a time), so later
+    chunks are usually ready by the time the earlier ones have been sent.
+    """
+    engine, profile = resolve_voice_output(backend, profile)
+    slots = asyncio.Semaphore(TTS_MAX_PARALLEL)
+
+    async def synthesize(chunk):
+        async with slots:
+            return await engine.synthesize(chunk, language_code, voice_name, profile)
+
+    tasks = [asyncio.ensure_future(synthesize(chunk)) for chunk in chunks]
+    try:
+        for index, task in enumerate(tasks):
+            audio, chunk_timings = await task
+            yield index, audio, chunk_timings
+    finally:
+        # Consumer gone or a chunk failed: stop the rest and collect their outcomes,
+        # so no task is orphaned or leaves an unretrieved exception behind
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
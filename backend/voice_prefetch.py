@@ -0,0 +1,86 @@
+# voice_prefetch.py
+
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+from routers.generate_voice import VoiceRequest, index_voice, interactive_syntheses, synthesize_cached
+
+logger = logging.getLogger("voice_prefetch")
+
+# Off by default: most, but not all, answers get listened to, and each one costs TTS quota
+VOICE_PREFETCH_ENABLED = os.getenv("VOICE_PREFETCH_ENABLED", "false").lower() in ("true", "1", "yes")
+# Answers waiting for synthesis; beyond this new ones are dropped rather than queued
+VOICE_PREFETCH_QUEUE_SIZE = int(os.getenv("VOICE_PREFETCH_QUEUE_SIZE", "32"))
+VOICE_PREFETCH_WORKERS = int(os.getenv("VOICE_PREFETCH_WORKERS", "1"))
+# Longer answers are left for an explicit listen
+VOICE_PREFETCH_MAX_CHARS = int(os.getenv("VOICE_PREFETCH_MAX_CHARS", "8000"))
+# Queued answers older than this are stale (the student has moved on)
+VOICE_PREFETCH_MAX_AGE = float(os.getenv("VOICE_PREFETCH_MAX_AGE", "300"))
+# How often a waiting worker checks whether interactive synthesis has finished
+VOICE_PREFETCH_IDLE_POLL = float(os.getenv("VOICE_PREFETCH_IDLE_POLL", "0.2"))
+
+_queue = None
+_workers = []
+
+def schedule_voice_prefetch(text: str, user_id: str, session_id: str, query_id: str) -> bool:
+    """
+    Queue the detailed answer of an /ask/ for background synthesis with the voice the
+    listen button uses. Never blocks: returns False when disabled, too long or the queue is full.
+    """
+    if _queue is None or not text or len(text) > VOICE_PREFETCH_MAX_CHARS:
+        return False
+    request = VoiceRequest(text=text, session_id=session_id, query_id=query_id)
+    try:
+        _queue.put_nowait((time.monotonic(), user_id, request))
+    except asyncio.QueueFull:
+        metrics.inc("voice_prefetch.dropped")
+        return False
+    metrics.inc("voice_prefetch.queued")
+    return True
+
+async def _wait_until_idle():
+    # Lower priority than interactive requests: start only when none are synthesizing
+    while interactive_syntheses() > 0:
+        await asyncio.sleep(VOICE_PREFETCH_IDLE_POLL)
+
+async def _prefetch_loop():
+    while True:
+        queued_at, user_id, request = await _queue.get()
+        try:
+            if time.monotonic() - queued_at > VOICE_PREFETCH_MAX_AGE:
+                metrics.inc("voice_prefetch.expired")
+                continue
+            await _wait_until_idle()
+            audio_path, timings, cached = await synthesize_cached(request, background=True)
+            # Index by query so /voice/audio finds it without a synthesis call; it is
+            # only published (linked into the user's folder) if someone asks for it
+            await asyncio.to_thread(index_voice, audio_path, timings, request, user_id)
+            metrics.inc("voice_prefetch.already_cached" if cached else "voice_prefetch.synthesized")
+        except Exception as e:
+            logger.warning("Voice prefetch failed for query %s: %s", request.query_id, e)
+            metrics.inc("voice_prefetch.failed")
+        finally:
+            _queue.task_done()
+
+def start_voice_prefetch():
+    """Start the prefetch workers if VOICE_PREFETCH_ENABLED; call from the event loop (app startup)"""
+    global _queue
+    if not VOICE_PREFETCH_ENABLED or _workers:
+        return
+    _queue = asyncio.Queue(maxsize=VOICE_PREFETCH_QUEUE_SIZE)
+    loop = asyncio.get_running_loop()
+    for _ in range(VOICE_PREFETCH_WORKERS):
+        _workers.append(loop.create_task(_prefetch_loop()))
+
+def stop_voice_prefetch():
+    global _queue
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
+    _queue = None
+
+def queue_state() -> dict:
+    return {"enabled": _queue is not None, "queued": _queue.qsize() if _queue is not None else 0}
@@ -4,6 +4,7 @@ import { useChatStore } from '../../store/chatStore'
 import { X, Play, Pause, Volume2 } from 'lucide-react'
 import { useState, useRef, useEffect } from 'react'
 import { apiService } from '../../lib/api'
+import { StreamingAudio } from '../../lib/streamingAudio'
 
 interface VoiceSidebarProps {
   isOpen: boolean
@@ -24,7 +25,9 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
   const [isLoading, setIsLoading] = useState(false)
   const [voiceExplanation, setVoiceExplanation] = useState<VoiceExplanation | null>(null)
   const [error, setError] = useState<string | null>(null)
-  const [cachedExplanations, setCachedExplanations] = useState<Record<string, VoiceExplanation>>({})
+  // A ref, not state: storing a finished clip must not re-run the session effect and cut off playback
+  const cachedExplanations = useRef<Record<string, VoiceExplanation>>({})
+  const streamingAudioRef = useRef<StreamingAudio | null>(null)
   const audioRef = useRef<HTMLAudioElement>(null)
 
   useEffect(() => {
@@ -45,13 +48,17 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
       
       if (lastAssistantMessage) {
         const cacheKey = lastAssistantMessage.query_id || lastAssistantMessage.id
-        if (cacheKey && cachedExplanations[cacheKey]) {
+        if (cacheKey && cachedExplanations.current[cacheKey]) {
           console.log("Loading cached voice explanation for message:", cacheKey)
-          setVoiceExplanation(cachedExplanations[cacheKey])
+          setVoiceExplanation(cachedExplanations.current[cacheKey])
         }
       }
     }
-  }, [currentSession, cachedExplanations])
+  }, [currentSession])
+
+  useEffect(() => {
+    return () => streamingAudioRef.current?.release()
+  }, [])
 
   useEffect(() => {
     // Generate voice explanation when sidebar is opened
@@ -110,9 +117,9 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
     
     // Check cache first
     const cacheKey = lastAssistantMessage.query_id || lastAssistantMessage.id
-    if (cacheKey && cachedExplanations[cacheKey]) {
+    if (cacheKey && cachedExplanations.current[cacheKey]) {
       console.log("Using cached voice explanation for message:", cacheKey)
-      setVoiceExplanation(cachedExplanations[cacheKey])
+      setVoiceExplanation(cachedExplanations.current[cacheKey])
       setIsLoading(false)
       return
     }
@@ -138,7 +145,16 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
         }
       }
       
-      // If no existing audio found, generate new one
+      // If no existing audio found, stream a new one where the browser can play it as it arrives
+      if ((!response || !response.audio_url) && StreamingAudio.isSupported()) {
+        console.log("Streaming new voice explanation...");
+        if (await streamVoiceExplanation(textToVoice, sessionIdAtStart, queryId, cacheKey)) {
+          return
+        }
+        console.log("Browser can't stream this audio format, generating the whole clip instead");
+      }
+
+      // Otherwise generate the whole clip first
       if (!response || !response.audio_url) {
         console.log("Generating new voice explanation...");
         // Call the API to generate voice with organization parameters
@@ -213,10 +229,7 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
         // Cache the explanation for this message
         const cacheKey = lastAssistantMessage.query_id || lastAssistantMessage.id;
         if (cacheKey) {
-          setCachedExplanations(prev => ({
-            ...prev,
-            [cacheKey]: newVoiceExplanation
-          }));
+          cachedExplanations.current[cacheKey] = newVoiceExplanation;
           console.log("Cached voice explanation for message:", cacheKey);
         }
       } else {
@@ -246,6 +259,69 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
     }
   }
 
+  // Plays the clip chunk by chunk while it is synthesized; the player (and the text)
+  // appears with the first chunk instead of after the whole clip. Resolves to false,
+  // before any audio, if the browser can't stream the clip's format.
+  const streamVoiceExplanation = async (text: string, sessionId: string, queryId: string, cacheKey?: string) => {
+    streamingAudioRef.current?.release()
+    streamingAudioRef.current = null
+    // Created once the stream's meta event names the content type
+    let player = null as StreamingAudio | null
+    let keepPlayer = false
+    const isCurrentSession = () => useChatStore.getState().currentSession?.id === sessionId
+    let timings: VoiceExplanation['timings'] = []
+
+    try {
+      const result = await apiService.streamVoice(
+        text,
+        (chunk) => {
+          if (!player || !isCurrentSession()) return
+          player.append(chunk.audio)
+          timings = [...timings, ...chunk.timings]
+          setVoiceExplanation({ text, timings, audioUrl: player.url })
+          setIsLoading(false)
+        },
+        'en-US',
+        'en-US-Wavenet-D',
+        sessionId,
+        queryId,
+        undefined,
+        undefined,
+        (meta) => {
+          if (!StreamingAudio.isSupported(meta.content_type)) return false
+          player = new StreamingAudio(meta.content_type)
+          streamingAudioRef.current = player
+        }
+      )
+      if (!result || !player) return false
+      player.end()
+
+      if (!isCurrentSession()) {
+        console.log("Session changed during voice streaming, discarding result")
+        return true
+      }
+      // Keep playing the streamed copy; later visits load the stored clip
+      keepPlayer = true
+      setVoiceExplanation({ text, timings: result.timings, audioUrl: player.url })
+      if (cacheKey) {
+        cachedExplanations.current[cacheKey] = {
+          text,
+          timings: result.timings,
+          audioUrl: convertToBackendURL(result.audio_url)
+        }
+        console.log("Cached voice explanation for message:", cacheKey)
+      }
+      return true
+    } finally {
+      // Failed midway, discarded or never started: don't leave the object URL behind
+      if (player && !keepPlayer) {
+        player.release()
+        if (streamingAudioRef.current === player) streamingAudioRef.current = null
+        if (isCurrentSession()) setVoiceExplanation(null)
+      }
+    }
+  }
+
   // Enhanced voice explanation generation
   const generateEnhancedExplanation = async () => {
     if (!currentSession || currentSession.messages.length === 0) {
@@ -268,12 +344,16 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
     try {
       console.log("Generating enhanced voice explanation for:", lastUserMessage.content.substring(0, 100))
       
+      const lastAssistantMessage = [...currentSession.messages]
+        .reverse()
+        .find(msg => msg.type === 'assistant')
       const enhancedResponse = await apiService.getVoiceExplanation(
         lastUserMessage.content,
         currentSession.id,
         lastUserMessage.sentiment || 'NEUTRAL',
         0,
-        'text'
+        'text',
+        lastAssistantMessage?.query_id
       )
       
       if (enhancedResponse?.voice_explanation) {
@@ -333,16 +413,20 @@ export default function VoiceSidebar({ isOpen }: VoiceSidebarProps) {
     }
 
     const updateDuration = () => {
-      setDuration(audio.duration)
+      // A stream still being appended has no finite duration yet; the timings know where it ends
+      const lastTiming = voiceExplanation?.timings[voiceExplanation.timings.length - 1]
+      setDuration(Number.isFinite(audio.duration) ? audio.duration : lastTiming?.end ?? 0)
     }
 
     audio.addEventListener('timeupdate', updateTime)
     audio.addEventListener('loadedmetadata', updateDuration)
+    audio.addEventListener('durationchange', updateDuration)
     audio.addEventListener('ended', () => setIsPlaying(false))
 
     return () => {
       audio.removeEventListener('timeupdate', updateTime)
       audio.removeEventListener('loadedmetadata', updateDuration)
+      audio.removeEventListener('durationchange', updateDuration)
       audio.removeEventListener('ended', () => setIsPlaying(false))
     }
   }, [voiceExplanation])
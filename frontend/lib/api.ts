@@ -113,7 +113,8 @@ export const apiService = {
     return response.data
   },
 
-  generateVoice: async (text: string, language: string = 'en-US', voiceName: string = 'en-US-Wavenet-D', sessionId?: string, queryId?: string, chatId?: string) => {
+  // profile picks the output encoding: 'mp3' (default), 'mp3_low', 'opus' (smallest) or 'linear16'
+  generateVoice: async (text: string, language: string = 'en-US', voiceName: string = 'en-US-Wavenet-D', sessionId?: string, queryId?: string, chatId?: string, profile?: string) => {
     // Use the test endpoint for now to avoid authentication issues
     const response = await api.post('/voice/generate-test', {
       text: text,
@@ -121,11 +122,82 @@ export const apiService = {
       voice_name: voiceName,
       session_id: sessionId,
       query_id: queryId,
-      chat_id: chatId
+      chat_id: chatId,
+      profile: profile
     })
     return response.data
   },
 
+  // Streaming voice generation: onAudio receives each audio chunk (with its timings) as soon as
+  // it is synthesized; resolves with the final { audio_url, timings } once the clip is stored
+  streamVoice: async (
+    text: string,
+    onAudio: (chunk: { index: number; audio: Uint8Array; timings: Array<{ start: number; end: number; text: string }> }) => void,
+    language: string = 'en-US',
+    voiceName: string = 'en-US-Wavenet-D',
+    sessionId?: string,
+    queryId?: string,
+    chatId?: string,
+    profile?: string,
+    // Called with the stream's `meta` event before any audio; return false to stop
+    // the stream (e.g. the browser can't play that content type), which resolves to null
+    onMeta?: (meta: { chunks: number; content_type: string; cached: boolean }) => boolean | void
+  ) => {
+    // Use the test endpoint for now to avoid authentication issues
+    const response = await fetch(`${API_BASE_URL}/voice/stream-test`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        text: text,
+        language_code: language,
+        voice_name: voiceName,
+        session_id: sessionId,
+        query_id: queryId,
+        chat_id: chatId,
+        profile: profile
+      })
+    })
+    if (!response.ok || !response.body) {
+      throw new Error(`Voice stream failed: ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+        let event = 'message'
+        let data = ''
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim()
+          else if (line.startsWith('data:')) data += line.slice(5).trim()
+        }
+        if (!data) continue
+        const payload = JSON.parse(data)
+        if (event === 'meta') {
+          if (onMeta?.(payload) === false) {
+            await reader.cancel()
+            return null
+          }
+        } else if (event === 'audio') {
+          const bytes = Uint8Array.from(atob(payload.audio), (c) => c.charCodeAt(0))
+          onAudio({ index: payload.index, audio: bytes, timings: payload.timings })
+        } else if (event === 'done') {
+          return payload
+        } else if (event === 'error') {
+          throw new Error(payload.error)
+        }
+      }
+    }
+    throw new Error('Voice stream ended without a result')
+  },
+
   // Get audio by query ID
   getAudioByQueryId: async (queryId: string, sessionId?: string) => {
     const params = new URLSearchParams({ query_id: queryId })
@@ -185,7 +257,8 @@ export const apiService = {
   },
 
   // Voice explanation endpoint
-  getVoiceExplanation: async (queryText: string, sessionId: string, sentimentLabel: string = 'NEUTRAL', sentimentScore: number = 0, inputType: string = 'text') => {
+  // Pass queryId to reuse the detailed answer already generated by /ask/
+  getVoiceExplanation: async (queryText: string, sessionId: string, sentimentLabel: string = 'NEUTRAL', sentimentScore: number = 0, inputType: string = 'text', queryId?: string) => {
     const response = await api.post('/ask/voice-explanation', {
       query_text: queryText,
       session_id: sessionId,
@@ -193,7 +266,8 @@ export const apiService = {
       sentiment_label: sentimentLabel,
       sentiment_score: sentimentScore,
       input_type: inputType,
-      language: 'en'
+      language: 'en',
+      query_id: queryId
     })
     return response.data
   },
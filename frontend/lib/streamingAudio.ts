@@ -0,0 +1,54 @@
+// Plays audio chunks from apiService.streamVoice back-to-back on one <audio> timeline
+// as they arrive, using Media Source Extensions. Set `url` as the element's src.
+export class StreamingAudio {
+  readonly url: string
+  private mediaSource = new MediaSource()
+  private sourceBuffer: SourceBuffer | null = null
+  private pending: Uint8Array[] = []
+  private finished = false
+
+  // Without a content type: whether the browser has Media Source Extensions at all
+  static isSupported(contentType?: string): boolean {
+    return typeof window !== 'undefined' && 'MediaSource' in window &&
+      (!contentType || MediaSource.isTypeSupported(contentType))
+  }
+
+  // `contentType` is the stream's meta.content_type; check isSupported(contentType) first
+  constructor(private contentType: string) {
+    this.url = URL.createObjectURL(this.mediaSource)
+    // Fires once the url is attached to an <audio> element
+    this.mediaSource.addEventListener('sourceopen', () => {
+      this.sourceBuffer = this.mediaSource.addSourceBuffer(this.contentType)
+      // Chunks carry no timestamps of their own; place each one right after the previous
+      this.sourceBuffer.mode = 'sequence'
+      this.sourceBuffer.addEventListener('updateend', () => this.flush())
+      this.flush()
+    }, { once: true })
+  }
+
+  append(chunk: Uint8Array): void {
+    this.pending.push(chunk)
+    this.flush()
+  }
+
+  // No more chunks: lets the element report the real duration and fire 'ended'
+  end(): void {
+    this.finished = true
+    this.flush()
+  }
+
+  release(): void {
+    URL.revokeObjectURL(this.url)
+  }
+
+  private flush(): void {
+    const buffer = this.sourceBuffer
+    if (!buffer || buffer.updating || this.mediaSource.readyState !== 'open') return
+    const next = this.pending.shift()
+    if (next) {
+      buffer.appendBuffer(next)
+    } else if (this.finished) {
+      this.mediaSource.endOfStream()
+    }
+  }
+}